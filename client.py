@@ -1,6 +1,9 @@
+import os
 import sys
+import collections
 import socket
 import selectors
+import threading
 import tkinter as tk
 import msg_client
 from gui import ClientGUI
@@ -13,43 +16,116 @@ sel = None
 host = None
 port = None
 protocol = None
+msg_obj = None  # The Message for the single server connection
+
+# Outbound requests from the GUI thread, handed to the network thread.
+# deque.append/popleft are atomic, so no lock is needed between them.
+tx_queue = collections.deque()
+wake_r = None
+wake_w = None
+
+# Selector data for the wake pipe, and the tx_queue item that stops the loop
+_WAKE = object()
+_SHUTDOWN = None
+
+# Set while a wake-up byte is in the pipe and not yet drained
+wake_pending = False
+
+# The network thread, started once for the life of the client
+net_thread = None
 
 def initialize_client(server_host, server_port, input_protocol):
     """Initialize the client with the given host and port."""
-    global sel, host, port, protocol
+    global sel, host, port, protocol, wake_r, wake_w
     sel = selectors.DefaultSelector()
     host = server_host
     port = server_port
     protocol = input_protocol
+
+    # Self-pipe so the GUI thread can wake the network thread
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    sel.register(wake_r, selectors.EVENT_READ, data=_WAKE)
     return sel
 
 # Send message to the server
 def send_to_server(request):
+    """Queue a request for the network thread (safe to call from any thread)."""
     if sel is None:
         logger.error("Client not initialized. Call initialize_client first.")
         return
-        
+
+    global wake_pending
     try:
-        for key in list(sel.get_map().values()):
-            msg_obj = key.data  # This is the Message instance
-            
-            # Set the request and queue it
-            msg_obj.request = request
-            msg_obj.queue_request()          # Queue the message for sending
-            
-            # # Set selector to listen for write events
-            msg_obj._set_selector_events_mask("w")
+        tx_queue.append(request)
+        # Only pay for the write syscall if the network thread isn't
+        # already due to drain the queue
+        if not wake_pending:
+            wake_pending = True
+            os.write(wake_w, b"\0")
     except Exception as e:
         logger.error(f"Error sending to server: {e}")
 
+def drain_tx_queue():
+    """Move queued requests onto the connection (network thread only).
+
+    Connects on the first request, and again on the next request after
+    the server connection is lost. Returns False once the shutdown
+    sentinel has been dequeued.
+    """
+    global wake_pending
+    # Empty the wake pipe
+    try:
+        while os.read(wake_r, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+    # Clear only after draining, or a wake-up written in between would be
+    # eaten while the flag stays set. Anything queued before this point is
+    # popped below; anything after it writes a new wake-up.
+    wake_pending = False
+
+    queued = False
+    running = True
+    while True:
+        try:
+            request = tx_queue.popleft()
+        except IndexError:
+            break
+        if request is _SHUTDOWN:
+            running = False
+            break
+        try:
+            if msg_obj is None:
+                # First request, or the server dropped us: (re)connect
+                start_connection(gui, None)
+            # Frames are appended to the send buffer and go out in one send()
+            msg_obj.queue_request(request)
+        except Exception as e:
+            # Report it and keep going: this is the only network thread
+            logger.error(f"Error sending {request.get('action')} request: {e}")
+            gui.queue_server_response({"error": f"Could not send request: {e}"}, "error")
+            continue
+        queued = True
+
+    if queued and msg_obj is not None:
+        # Set selector to listen for write events
+        msg_obj._set_selector_events_mask("w")
+    return running
+
 # Thread for handling server communication
-def network_thread(request):
-    logger.info(request)
-    start_connection(gui, request)
+def network_thread():
+    """Run the selector loop until the shutdown sentinel is queued."""
     try:
-        while True:
-            events = sel.select(timeout=1)
+        running = True
+        while running:
+            # Block until socket activity or a wake-up from the GUI thread
+            events = sel.select(timeout=None)
             for key, mask in events:
+                if key.data is _WAKE:
+                    running = drain_tx_queue()
+                    continue
                 message = key.data
                 try:
                     message.process_events(mask)
@@ -58,30 +134,70 @@ def network_thread(request):
                         f"Main: Error: Exception for {message.addr}"
                     )
                     message.close()
-            # Check for a socket being monitored to continue.
-            if not sel.get_map():
-                break
+                    if message is msg_obj:
+                        set_connection(None)
     except KeyboardInterrupt:
         logger.info("Caught keyboard interrupt, exiting")
     finally:
+        if msg_obj is not None:
+            msg_obj.close()
+            set_connection(None)
         logger.info("selectors closed")
         sel.close()
 
+def start_network_thread():
+    """Start the network thread; it idles in select() until the first request."""
+    global net_thread
+    net_thread = threading.Thread(target=network_thread, daemon=True)
+    net_thread.start()
+    return net_thread
+
+def on_close():
+    """Stop the network thread, release its fds and close the window."""
+    if net_thread is not None and net_thread.is_alive():
+        # The thread closes the connection and the selector on its way out
+        send_to_server(_SHUTDOWN)
+        net_thread.join(timeout=1)
+        if net_thread.is_alive():
+            logger.error("Network thread did not stop, exiting anyway")
+        else:
+            os.close(wake_r)
+            os.close(wake_w)
+    elif sel is not None:
+        sel.close()
+        os.close(wake_r)
+        os.close(wake_w)
+    root.destroy()
+
 
 # Main GUI Application
 root = tk.Tk()
-gui = ClientGUI(root, send_to_server, network_thread)
+gui = ClientGUI(root, send_to_server)
+root.protocol("WM_DELETE_WINDOW", on_close)
 
 # Networking Functions
+def set_connection(message):
+    """Remember the Message for the current server connection."""
+    global msg_obj
+    msg_obj = message
+
 def start_connection(gui, request):
     addr = (host, port)
     logger.info(f"Starting connection to {addr}")
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Requests are already batched into one send() per wake-up, so don't
+    # let Nagle hold them back waiting for an ACK
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     sock.setblocking(False)
     sock.connect_ex(addr)
     events = selectors.EVENT_READ | selectors.EVENT_WRITE
-    message = msg_client.Message(sel, sock, addr, gui, request, protocol)
-    sel.register(sock, events, data=message)
+    try:
+        message = msg_client.Message(sel, sock, addr, gui, request, protocol)
+        sel.register(sock, events, data=message)
+    except Exception:
+        sock.close()
+        raise
+    set_connection(message)
 
 
 def main():
@@ -98,10 +214,16 @@ def main():
     except ValueError:
         logger.info(f"Error: Port must be a number")
         sys.exit(1)
+
+    # Fail now rather than on every request
+    if input_protocol == "msgpack" and msg_client.msgpack is None:
+        print("Error: msgpack protocol requires the msgpack package")
+        sys.exit(1)
     
     # Initialize client
     if server_port is not None:
         initialize_client(server_host, server_port, input_protocol)
+        start_network_thread()
         # Run the Tkinter main loop
         root.mainloop()
 
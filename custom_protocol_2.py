@@ -1,64 +1,128 @@
+import re
+
+# Characters _split_items has to look at; everything else is skipped in C.
+# An escape (backslash plus the escaped quote or backslash) is matched as
+# one token so it never toggles string mode.
+_STRUCTURAL = re.compile(r'\\[\\"]|["{}\[\],]')
+
+# Escaped character inside a serialized string
+_ESCAPE = re.compile(r'\\(.)', re.DOTALL)
+
+# Characters that force a dictionary key to be quoted
+_KEY_SPECIAL = frozenset(":{},[]")
+
+
+def _serialize_into(data, out):
+    """Append the serialized pieces of data to out.
+
+    Nested values write into the same list, so a message is joined once
+    at the end instead of building a string per container. Exact type
+    checks come first since they are the common case on the wire.
+    """
+    kind = type(data)
+    if kind is str:
+        if "\\" in data:
+            data = data.replace("\\", "\\\\")  # Escape backslashes first
+        out.append('"' + data.replace('"', '\\"') + '"')  # Escape quotes properly
+    elif kind is list:
+        out.append("[")
+        first = True
+        for item in data:
+            if first:
+                first = False
+            else:
+                out.append(",")
+            _serialize_into(item, out)
+        out.append("]")
+    elif kind is dict:
+        out.append("{")
+        first = True
+        for key, value in data.items():
+            if first:
+                first = False
+            else:
+                out.append(",")
+            out.append(CustomProtocol._escape_key(str(key)) + ":")
+            _serialize_into(value, out)
+        out.append("}")
+    elif kind is bool:  # Handle booleans explicitly
+        out.append("true" if data else "false")
+    elif data is None:  # Handle None values
+        out.append("null")
+    elif isinstance(data, str):  # Subclasses fall back to the plain type
+        _serialize_into(str(data), out)
+    elif isinstance(data, list):
+        _serialize_into(list(data), out)
+    elif isinstance(data, dict):
+        _serialize_into(dict(data), out)
+    else:
+        out.append(str(data))  # Handles int and float
+
+
 class CustomProtocol:
-    def __init__(self):
-        self.keys = [
-            "accounts", # list of dicts
-            "action",
-            "content-length",
-            "checksum",
-            "error",
-            "message",
-            "messages", # list of dicts
-            "msgids", # list of ints
-            "num_messages",
-            "num_pending",
-            "offset",
-            "password",
-            "recipient_username",
-            "search_term",
-            "sender_username",
-            "sender_uuid",
-            "success",
-            "timestamp",
-            "total_count",
-            "username",
-            "uuid",
-            "deleter_uuid",
-            "current_uuid",
-            "other_username",
-        ]
-
-        # defines order in which fields appear after listifying request types (alphabetical)
-        self.dict_reconstruction = {
-            "header": ["action", "content-length", "checksum"],
-            "load_page_data": ["uuid"],
-            "search_accounts": ["offset", "search_term"],
-            "delete_messages": ["msgids", "deleter_uuid"],
-            "load_undelivered": ["num_messages", "uuid"],
-            "load_messages": ["num_messages", "uuid"],
-            "send_message": ["message", "recipient_username", "timestamp", "uuid"],
-            "login": ["password", "username"],
-            "delete_account": ["password", "uuid"],
-            "check_username": ["username"],
-            "register": ["password", "username"],
-            "login_error": ["message"],
-            "login_r": ["uuid"],
-            "load_page_data_r": ["accounts", "messages", "num_pending", "total_count"],
-            "search_accounts_r": ["accounts", "total_count"],
-            "load_messages_r": ["messages", "total_count"],
-            "send_message_r": ["error", "success"],
-            "receive_message_r": ["message", "sender_username", "sender_uuid"],
-            "load_undelivered_r": ["messages"],
-            "delete_messages_r": ["total_count"],
-            "delete_account_r": ["error", "success"],
-            "error": ["error"],
-            "refresh_accounts_r": ["message"],
-            "check_username_r": ["message"],
-            "register_r": ["uuid"],
-            "delete_account_refresh_r": ["error", "success", "total_count"],
-            "load_private_chat_r": ["messages"],
-            "load_private_chat": ["current_uuid", "other_username"]
-        }
+    # The tables below are the same for every connection, so they live on
+    # the class instead of being rebuilt for each Message
+    keys = (
+        "accounts", # list of dicts
+        "action",
+        "content-length",
+        "checksum",
+        "error",
+        "message",
+        "messages", # list of dicts
+        "msgids", # list of ints
+        "num_messages",
+        "num_pending",
+        "offset",
+        "password",
+        "recipient_username",
+        "search_term",
+        "sender_username",
+        "sender_uuid",
+        "success",
+        "timestamp",
+        "total_count",
+        "username",
+        "uuid",
+        "deleter_uuid",
+        "current_uuid",
+        "other_username",
+    )
 
+    # defines order in which fields appear after listifying request types (alphabetical)
+    dict_reconstruction = {
+        "header": ["action", "content-length", "checksum"],
+        "load_page_data": ["uuid"],
+        "search_accounts": ["offset", "search_term"],
+        "delete_messages": ["msgids", "deleter_uuid"],
+        "load_undelivered": ["num_messages", "uuid"],
+        "load_messages": ["num_messages", "uuid"],
+        "send_message": ["message", "recipient_username", "timestamp", "uuid"],
+        "login": ["password", "username"],
+        "delete_account": ["password", "uuid"],
+        "check_username": ["username"],
+        "register": ["password", "username"],
+        "login_error": ["message"],
+        "login_r": ["uuid"],
+        "load_page_data_r": ["accounts", "messages", "num_pending", "total_count"],
+        "search_accounts_r": ["accounts", "total_count"],
+        "load_messages_r": ["messages", "total_count"],
+        "send_message_r": ["error", "success"],
+        "receive_message_r": ["message", "sender_username", "sender_uuid"],
+        "load_undelivered_r": ["messages"],
+        "delete_messages_r": ["total_count"],
+        "delete_account_r": ["error", "success"],
+        "error": ["error"],
+        "refresh_accounts_r": ["message"],
+        "check_username_r": ["message"],
+        "register_r": ["uuid"],
+        "delete_account_refresh_r": ["error", "success", "total_count"],
+        "load_private_chat_r": ["messages"],
+        "load_private_chat": ["current_uuid", "other_username"]
+    }
+
+    # action names already in their serialized form, for serialize_header
+    action_bytes = {action: f'"{action}"'.encode() for action in dict_reconstruction}
 
     @staticmethod
     def compute_checksum(data):
@@ -68,33 +132,38 @@ class CustomProtocol:
     @staticmethod
     def serialize_part(data):
         """Stringify data types"""
-        if isinstance(data, dict):
-            items = [f"{CustomProtocol._escape_key(str(key))}:{CustomProtocol.serialize_part(value)}" for key, value in data.items()]
-            return "{" + ",".join(items) + "}"
-        elif isinstance(data, list):
-            serialized_items = [CustomProtocol.serialize_part(item) for item in data]
-            return "[" + ",".join(serialized_items) + "]"
-        elif isinstance(data, str):
-            return '"' + data.replace('"', '\\"') + '"'  # Escape quotes properly
-        elif isinstance(data, bool):  # Handle booleans explicitly
-            return "true" if data else "false"
-        elif data is None:  # Handle None values
-            return "null"
-        else:
-            return str(data)  # Handles int and float
-
-
-    def serialize(self, dictionary):
-        """Serialize a dictionary to a stringified list."""
-        res = []
+        out = []
+        _serialize_into(data, out)
+        return "".join(out)
+
+
+    def serialize(self, dictionary, action=None):
+        """Serialize a dictionary to a stringified list.
+
+        With a known action only that action's fields are looked up; they
+        are listed in the same order as self.keys, so the output matches.
+        """
         # fields inserted in list in alphabetical order
-        for key in self.keys:
-            if key in dictionary:
-                res.append(CustomProtocol.serialize_part(dictionary[key]))
-        res_string = "[" + ",".join(res) + "]"
-        return res_string.encode()
+        fields = self.dict_reconstruction.get(action, self.keys)
+        values = [dictionary[key] for key in fields if key in dictionary]
+        out = []
+        _serialize_into(values, out)
+        return "".join(out).encode()
     
 
+    def serialize_header(self, action, content_length, checksum):
+        """Serialize a message header.
+
+        Same output as serialize(header, "header"), but the header always
+        has the same three fields and the action is usually a known name,
+        so it is formatted directly.
+        """
+        action_bytes = self.action_bytes.get(action)
+        if action_bytes is None:
+            header = {"action": action, "content-length": content_length, "checksum": checksum}
+            return self.serialize(header, "header")
+        return b"[%b,%d,%d]" % (action_bytes, content_length, checksum)
+
     @staticmethod
     def deserialize_part(data):
         """Parses a string representation back into original datatype"""
@@ -105,18 +174,25 @@ class CustomProtocol:
         elif data.startswith("[") and data.endswith("]"):
             return CustomProtocol._parse_list(data[1:-1])
         elif data.startswith('"') and data.endswith('"'):
-            return data[1:-1].replace('\\"', '"')  # Unescape quotes
+            data = data[1:-1]
+            if "\\" in data:
+                data = _ESCAPE.sub(r"\1", data)  # Unescape quotes and backslashes
+            return data
         elif data == "true":
             return True
         elif data == "false":
             return False
         elif data == "null":
             return None
-        elif "." in data and data.replace(".", "", 1).isdigit():
-            return float(data)
-        elif CustomProtocol._is_number(data):
+        # Numbers: let int()/float() do the checking in C rather than
+        # scanning the text first
+        try:
             return int(data)
-        else:
+        except ValueError:
+            pass
+        try:
+            return float(data)
+        except ValueError:
             return data  # Should not happen in well-formed input
        
 
@@ -141,21 +217,17 @@ class CustomProtocol:
         result = {}
         items = CustomProtocol._split_items(data)
         for item in items:
-            if ":" in item:
-                # Handle quoted keys by finding the first colon that's not inside quotes
-                in_quotes = False
-                colon_pos = -1
-                for i, char in enumerate(item):
-                    if char == '"':
-                        in_quotes = not in_quotes
-                    elif char == ':' and not in_quotes:
-                        colon_pos = i
-                        break
-                
-                if colon_pos != -1:
-                    key = item[:colon_pos]
-                    value = item[colon_pos + 1:]
-                    result[CustomProtocol._unescape_key(key)] = CustomProtocol.deserialize_part(value)
+            # Find the first colon that's not inside a quoted key
+            if item[:1] == '"':
+                close = item.find('"', 1)
+                colon_pos = item.find(":", close + 1) if close != -1 else -1
+            else:
+                colon_pos = item.find(":")
+
+            if colon_pos != -1:
+                key = item[:colon_pos]
+                value = item[colon_pos + 1:]
+                result[CustomProtocol._unescape_key(key)] = CustomProtocol.deserialize_part(value)
         return result
 
     @staticmethod
@@ -167,35 +239,30 @@ class CustomProtocol:
     @staticmethod
     def _split_items(data):
         """Splits serialized items while handling nested structures."""
-        items, stack, current, in_string = [], [], "", False
-        for char in data:
+        items, depth, in_string, start = [], 0, False, 0
+        for match in _STRUCTURAL.finditer(data):
+            char = match.group()
             if char == '"':
                 in_string = not in_string  # Toggle string mode
-            elif not in_string:
-                if char in "{[":
-                    stack.append(char)
-                elif char in "}]":
-                    stack.pop()
-                elif char == "," and not stack:
-                    items.append(current.strip())
-                    current = ""
-                    continue
-            current += char
-        if current.strip():
-            items.append(current.strip())
+            elif in_string or char[0] == "\\":
+                continue
+            elif char == ",":
+                if not depth:
+                    items.append(data[start:match.start()].strip())
+                    start = match.end()
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+        tail = data[start:].strip()
+        if tail:
+            items.append(tail)
         return items
     
-    @staticmethod
-    def _is_number(value):
-        """Checks if a string represents a number."""
-        if value.startswith("-"):
-                value = value[1:]
-        return value.replace(".", "", 1).isdigit()
-
     @staticmethod
     def _escape_key(key):
         """Escapes dictionary keys to ensure proper serialization."""
-        if any(c in key for c in ":{},[]"):
+        if not _KEY_SPECIAL.isdisjoint(key):
             return f'"{key}"'
         return key
 
@@ -4,13 +4,48 @@ from logger import set_logger
 
 logger = set_logger("db", "db.log")
 
+# Most search patterns whose user counts are kept (least recently used go first)
+COUNT_CACHE_SIZE = 64
+
+# login and delete_messages use UPDATE/DELETE ... RETURNING (SQLite 3.35+)
+MIN_SQLITE_VERSION = (3, 35, 0)
+
 class MessageDatabase:
     def __init__(self, db_file: str = "messages.db"):
         """Initialize the database connection."""
         self.db_file = db_file
         self.conn = None
+        # userid (as a string) -> associated socket, filled on register,
+        # login and lookup; the server is the only writer of that column
+        self._socket_cache = {}
+        # search pattern -> number of matching users, so paging through
+        # results doesn't recount; cleared whenever users are added or
+        # removed and capped at COUNT_CACHE_SIZE patterns
+        self._count_cache = {}
+        # username <-> userid (as a string); users are never renamed, so
+        # entries only go stale when an account is deleted
+        self._uuid_by_name = {}
+        self._name_by_uuid = {}
         self.create_tables()
 
+    def _cache_user(self, uuid, username):
+        """Remember a user's userid and username for later lookups."""
+        uuid = str(uuid)
+        self._uuid_by_name[username] = uuid
+        self._name_by_uuid[uuid] = username
+
+    def _rollback(self):
+        """Roll back a transaction left open by a failed statement.
+
+        The connection stays open between calls, so without this a failed
+        write would keep holding SQLite's write lock.
+        """
+        if self.conn is not None and self.conn.in_transaction:
+            try:
+                self.conn.rollback()
+            except sqlite3.Error as e:
+                logger.error(f"Error rolling back transaction: {e}")
+
     def close(self):
         """Close the database connection."""
         if self.conn:
@@ -18,26 +53,47 @@ class MessageDatabase:
             self.conn = None
 
     def connect(self):
-        """Create a database connection."""
+        """Return the database connection, opening it on first use.
+
+        The connection is kept open for the life of the object so each
+        query doesn't pay for a new open and schema parse. WAL with
+        synchronous=NORMAL turns each commit into a log append instead of
+        an fsync of the main database file. Temp tables and sorts stay in
+        memory, and reads go through an 8 MB page cache and a memory map.
+
+        Raises RuntimeError if the SQLite library is older than
+        MIN_SQLITE_VERSION, rather than failing every login later.
+        """
+        if self.conn is not None:
+            return self.conn
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            required = ".".join(map(str, MIN_SQLITE_VERSION))
+            raise RuntimeError(
+                f"SQLite {sqlite3.sqlite_version} is too old, {required} or newer is required"
+            )
         try:
             self.conn = sqlite3.connect(self.db_file)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA temp_store=MEMORY")
+            self.conn.execute("PRAGMA cache_size=-8000")
+            self.conn.execute("PRAGMA mmap_size=268435456")
             return self.conn
         except sqlite3.Error as e:
             logger.error(f"Error connecting to database: {e}")
+            self.close()
             return None
 
     def create_tables(self):
-        """Create the messages table if it doesn't exist."""
-        create_users_sql = """
+        """Create the tables and their indexes if they don't exist."""
+        schema_sql = """
         CREATE TABLE IF NOT EXISTS users (
             userid INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
             hashed_password TEXT NOT NULL,
             associated_socket TEXT
         );
-        """
 
-        create_messages_sql = """
         CREATE TABLE IF NOT EXISTS messages (
             msgid INTEGER PRIMARY KEY AUTOINCREMENT,
             senderuuid INTEGER NOT NULL,
@@ -48,22 +104,32 @@ class MessageDatabase:
             FOREIGN KEY (senderuuid) REFERENCES users(userid),
             FOREIGN KEY (recipientuuid) REFERENCES users(userid)
         );
+
+        -- LIKE is case-insensitive, so only a NOCASE index lets SQLite turn
+        -- a search_accounts prefix pattern into a range scan
+        CREATE INDEX IF NOT EXISTS idx_users_username_nocase
+            ON users(username COLLATE NOCASE);
+
+        -- Message loads filter on one side of the conversation (and on
+        -- status for the recipient) and return the newest first
+        CREATE INDEX IF NOT EXISTS idx_messages_recipient
+            ON messages(recipientuuid, status, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_messages_sender
+            ON messages(senderuuid, timestamp);
+        -- A private chat reads both directions of one pair of users
+        CREATE INDEX IF NOT EXISTS idx_messages_pair
+            ON messages(senderuuid, recipientuuid, timestamp);
         """
         try:
             conn = self.connect()
             if conn is not None:
-                cursor = conn.cursor()
-                cursor.execute(create_users_sql)
-                conn.commit()
-                cursor.execute(create_messages_sql)
-                conn.commit()
+                # the whole schema goes to SQLite in one call
+                conn.executescript(schema_sql)
             else:
                 logger.error("Error: Could not establish database connection")
         except sqlite3.Error as e:
             logger.error(f"Error creating table: {e}")
-        finally:
-            if conn:
-                conn.close()
+            self._rollback()
 
     def check_username(self, username: str):
         """Check if a username already exists in the database."""
@@ -78,10 +144,8 @@ class MessageDatabase:
             
         except sqlite3.Error as e:
             logger.error(f"Error checking username: {e}")
+            self._rollback()
             return None, False
-        finally:
-            if conn:
-                conn.close()
 
     def register(self, username: str, password: str, socket: str):
         """Register a new user."""
@@ -94,21 +158,27 @@ class MessageDatabase:
             cursor = conn.cursor()
             cursor.execute("INSERT INTO users (username, hashed_password, associated_socket) VALUES (?, ?, ?);", (username, password, socket))
             conn.commit()
-            uuid = self.get_user_uuid(username)[2]
+            # the new userid is the rowid of the insert; no need to look it up
+            uuid = str(cursor.lastrowid)
+            self._socket_cache[uuid] = socket
+            self._cache_user(uuid, username)
+            self._count_cache.clear()
             return uuid, ""
             
         except sqlite3.Error as e:
             logger.error(f"Error registering user: {e}")
+            self._rollback()
             return None, str(e)
 
-        finally:
-            if conn:
-                conn.close()
 
     def login(self, username: str, password: str, socket:str):
         """Login if the username and password match exactly 1 record, create an account if the username does not match any, else return an empty list."""
-        login_sql = """SELECT * FROM users WHERE username = ? AND hashed_password = ?;"""
-        update_socket_sql = """UPDATE users SET associated_socket = ? WHERE userid = ?;"""
+        # Match the credentials and record the new socket in one statement
+        login_sql = """
+            UPDATE users SET associated_socket = ?
+            WHERE username = ? AND hashed_password = ?
+            RETURNING userid, username, hashed_password, associated_socket;
+        """
 
         # Guard for empty strings; msg_server will handle this as failure
         if not username or not password or not socket:
@@ -121,32 +191,29 @@ class MessageDatabase:
             conn = self.connect()
             if conn is None:
                 return []
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
-            # Check if the username and password match records
-            cursor.execute(login_sql, (username, password))
+            logger.debug("logging in, socket: %s, length: %s", socket, len(socket))
+            cursor.execute(login_sql, (socket, username, password))
             res = cursor.fetchall()
 
             # Check if multiple users (or none) have the same username and password-- >0 should not happen
             if len(res) != 1:
+                conn.rollback()
                 logger.error("Error: multiple users with the same username and password")
                 return []
-            
-            user = res[0]
 
-            # update socket
-            logger.info(f"logging in, socket: {socket}, length: {len(socket)}")
-            cursor.execute(update_socket_sql, (socket, user["userid"]))
             conn.commit()
-            return [dict(user)]
+            # msg_server only reads userid, which sqlite3.Row serves by name
+            user = res[0]
+            self._socket_cache[str(user["userid"])] = socket
+            return [user]
 
         except sqlite3.Error as e:
             logger.error(f"Error in login_or_create_account: {e}")
+            self._rollback()
             return []
-        finally:
-            if conn:
-                conn.close()
                 
     def load_private_chat(self, current_uuid: int, other_username: str) -> List[dict]:
         """Load all messages between current user and other user.
@@ -198,6 +265,7 @@ class MessageDatabase:
             
         except sqlite3.Error as e:
             logger.error(f"Error loading private chat: {e}")
+            self._rollback()
             return []
             
     def get_user_uuid(self, username: str) -> tuple[bool, str, str]:
@@ -205,6 +273,9 @@ class MessageDatabase:
         Get a user's UUID by their username.
         Returns (success, error_message, uuid)
         """
+        uuid = self._uuid_by_name.get(username)
+        if uuid is not None:
+            return True, "", uuid
         try:
             conn = self.connect()
             if conn is None:
@@ -217,19 +288,21 @@ class MessageDatabase:
             if not user:
                 return False, f"User {username} not found", ""
                 
+            self._cache_user(user[0], username)
             return True, "", str(user[0])
             
         except sqlite3.Error as e:
             logger.error(f"Error getting user UUID: {e}")
+            self._rollback()
             return False, str(e), ""
-        finally:
-            if conn:
-                conn.close()
 
     def get_associated_socket(self, user_uuid: str) -> Optional[str]:
         """
         Get the associated socket (or None) for a user by their UUID.
         """
+        socket = self._socket_cache.get(str(user_uuid))
+        if socket is not None:
+            return socket
         try:
             conn = self.connect()
             if conn is None:
@@ -240,15 +313,15 @@ class MessageDatabase:
             result = cursor.fetchone()
             
             if result:
+                if result[0] is not None:
+                    self._socket_cache[str(user_uuid)] = result[0]
                 return result[0]
             return None
             
         except sqlite3.Error as e:
             logger.error(f"Error getting associated socket: {e}")
+            self._rollback()
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def store_message(self, sender_uuid: str, recipient_uuid: str, message_text: str, status: bool, timestamp) -> tuple[bool, str]:
         """
@@ -262,34 +335,33 @@ class MessageDatabase:
 
             cursor = conn.cursor()
             
-            # Validate sender UUID exists
-            cursor.execute("SELECT COUNT(*) FROM users WHERE userid = ?", (sender_uuid,))
-            if cursor.fetchone()[0] == 0:
-                return False, f"Invalid sender UUID: {sender_uuid}"
-            
-            # Validate recipient UUID exists
-            cursor.execute("SELECT COUNT(*) FROM users WHERE userid = ?", (recipient_uuid,))
-            if cursor.fetchone()[0] == 0:
-                return False, f"Invalid recipient UUID: {recipient_uuid}"
-            
             # Set message status based on recipient's socket status
             status = "delivered" if status else "pending"
             
-            # Insert the message using UUIDs directly
+            # Insert the message only if both users exist, in one statement
             cursor.execute("""
                 INSERT INTO messages (senderuuid, recipientuuid, message, status, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            """, (sender_uuid, recipient_uuid, message_text, status, timestamp,))
+                SELECT ?, ?, ?, ?, ?
+                WHERE EXISTS (SELECT 1 FROM users WHERE userid = ?)
+                    AND EXISTS (SELECT 1 FROM users WHERE userid = ?)
+            """, (sender_uuid, recipient_uuid, message_text, status, timestamp, sender_uuid, recipient_uuid))
+            
+            if cursor.rowcount == 0:
+                # Nothing inserted, but the INSERT opened a write transaction
+                conn.rollback()
+                # find out which user is missing
+                cursor.execute("SELECT 1 FROM users WHERE userid = ?", (sender_uuid,))
+                if cursor.fetchone() is None:
+                    return False, f"Invalid sender UUID: {sender_uuid}"
+                return False, f"Invalid recipient UUID: {recipient_uuid}"
             
             conn.commit()
             return True, ""
             
         except sqlite3.Error as e:
             logger.error(f"Error storing message: {e}")
+            self._rollback()
             return False, str(e)
-        finally:
-            if conn:
-                conn.close()
 
     def search_accounts(self, search_term: str, offset: int):
         """
@@ -297,7 +369,7 @@ class MessageDatabase:
         Returns (list of user dictionaries, total count of matching users)
         """
         try:
-            logger.info(f"DB Searching for term: '{search_term}' offset {offset}")
+            logger.debug("DB Searching for term: '%s' offset %s", search_term, offset)
             conn = self.connect()
             if conn is None:
                 logger.error("Database connection failed")
@@ -312,11 +384,16 @@ class MessageDatabase:
                 search_term = "%"  # Match all users if search term is empty
             
             # First get total count
-            count_sql = "SELECT COUNT(*) FROM users WHERE username LIKE ?"
-            cursor.execute(count_sql, (search_term,))
-            
-            total_count = cursor.fetchone()[0]
-            logger.info(f"Total matching users: {total_count}")
+            # (popped and reinserted so dict order tracks recent use)
+            total_count = self._count_cache.pop(search_term, None)
+            if total_count is None:
+                count_sql = "SELECT COUNT(*) FROM users WHERE username LIKE ?"
+                cursor.execute(count_sql, (search_term,))
+                total_count = cursor.fetchone()[0]
+                if len(self._count_cache) >= COUNT_CACHE_SIZE:
+                    del self._count_cache[next(iter(self._count_cache))]
+            self._count_cache[search_term] = total_count
+            logger.debug("Total matching users: %s", total_count)
             
             # Get paginated results
             search_sql = """
@@ -329,15 +406,13 @@ class MessageDatabase:
             cursor.execute(search_sql, (search_term, offset))
             
             results = [list(row) for row in cursor.fetchall()]
-            logger.info(f"Query results: {results}")
+            logger.debug("Query results: %s", results)
             return results, total_count
             
         except sqlite3.Error as e:
             logger.error(f"Error searching accounts: {e}")
+            self._rollback()
             return [], 0
-        finally:
-            if conn:
-                conn.close()
 
     def get_user_password(self, uuid: int) -> str:
         """
@@ -355,10 +430,8 @@ class MessageDatabase:
             
         except sqlite3.Error as e:
             logger.error(f"Error getting user password: {e}")
+            self._rollback()
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def delete_user_messages(self, uuid: int) -> List[Tuple[int, int]]:
         """Delete all messages associated with a user and return a list of (uuid, num_deleted) tuples.
@@ -376,21 +449,21 @@ class MessageDatabase:
                 
             cursor = conn.cursor()
             
-            # First get all messages where user is sender or recipient
+            # Count the user's messages per affected user in SQL: each
+            # message counts once for its sender and once for its recipient
             cursor.execute("""
-                SELECT senderuuid, recipientuuid FROM messages 
-                WHERE senderuuid = ? OR recipientuuid = ?
-            """, (uuid, uuid))
-            
-            # Track message counts per user
-            user_counts = {}
-            for sender_uuid, recipient_uuid in cursor.fetchall():
-                if sender_uuid not in user_counts:
-                    user_counts[sender_uuid] = 1
-                if recipient_uuid not in user_counts:
-                    user_counts[recipient_uuid] = 1
-                user_counts[sender_uuid] += 1
-                user_counts[recipient_uuid] += 1
+                SELECT uid, SUM(cnt) FROM (
+                    SELECT senderuuid AS uid, COUNT(*) AS cnt FROM messages
+                    WHERE senderuuid = ? OR recipientuuid = ?
+                    GROUP BY senderuuid
+                    UNION ALL
+                    SELECT recipientuuid AS uid, COUNT(*) AS cnt FROM messages
+                    WHERE senderuuid = ? OR recipientuuid = ?
+                    GROUP BY recipientuuid
+                )
+                GROUP BY uid
+            """, (uuid, uuid, uuid, uuid))
+            user_counts = cursor.fetchall()
             
             # Delete all messages
             cursor.execute("""
@@ -399,12 +472,11 @@ class MessageDatabase:
             """, (uuid, uuid))
             
             conn.commit()
-            
-            # Convert counts to list of tuples
-            return [(uuid, count) for uuid, count in user_counts.items()]
+            return user_counts
             
         except sqlite3.Error as e:
             logger.error(f"Error deleting user messages: {e}")
+            self._rollback()
             return []
             
     def delete_user(self, uuid: int) -> bool:
@@ -420,38 +492,34 @@ class MessageDatabase:
             cursor = conn.cursor()
             logger.info(f"Attempting to delete user with UUID: {uuid}")
             
-            # First check if user exists
-            cursor.execute("SELECT userid FROM users WHERE userid = ?", (uuid,))
-            user = cursor.fetchone()
-            if not user:
+            # Delete the user; rowcount tells whether the user existed
+            cursor.execute("DELETE FROM users WHERE userid = ?", (uuid,))
+            if cursor.rowcount != 1:
+                conn.rollback()
                 logger.error(f"No user found with UUID: {uuid}")
                 return False
-                
-            # Delete the user
-            cursor.execute("DELETE FROM users WHERE userid = ?", (uuid,))
             conn.commit()
-            
-            # Verify deletion
-            cursor.execute("SELECT userid FROM users WHERE userid = ?", (uuid,))
-            if cursor.fetchone() is None:
-                logger.info(f"Successfully deleted user with UUID: {uuid}")
-                return True
-            else:
-                logger.error(f"Failed to delete user with UUID: {uuid} - user still exists")
-                return False
+            self._socket_cache.pop(str(uuid), None)
+            username = self._name_by_uuid.pop(str(uuid), None)
+            if username is not None:
+                self._uuid_by_name.pop(username, None)
+            self._count_cache.clear()
+            logger.info(f"Successfully deleted user with UUID: {uuid}")
+            return True
             
         except sqlite3.Error as e:
             logger.error(f"Error deleting user: {e}")
+            self._rollback()
             return False
-        finally:
-            if conn:
-                conn.close()
 
     def get_user_username(self, uuid: int) -> dict:
         """
         Get a user's information by their UUID.
         """
-        logger.info(f"Getting user info for UUID: {uuid}")
+        logger.debug("Getting user info for UUID: %s", uuid)
+        username = self._name_by_uuid.get(str(uuid))
+        if username is not None:
+            return username
         try:
             conn = self.connect()
             if conn is None:
@@ -460,15 +528,15 @@ class MessageDatabase:
             cursor = conn.cursor()
             cursor.execute("SELECT username FROM users WHERE userid = ?", (uuid,))
             user = cursor.fetchone()
-            logger.info(f"User info (line 416): {user}")
+            logger.debug("User info (line 416): %s", user)
+            if user:
+                self._cache_user(uuid, user[0])
             return user[0] if user else None
             
         except sqlite3.Error as e:
             logger.error(f"Error getting user info: {e}")
+            self._rollback()
             return {}
-        finally:
-            if conn:
-                conn.close()
 
     def load_messages(self, user_uuid, num_messages):
         """Load the most recent messages for a user."""
@@ -477,26 +545,35 @@ class MessageDatabase:
             if conn is None:
                 return []
 
-            # get snapshot of num_messages most recent messages
+            # get snapshot of num_messages most recent messages. Received and
+            # sent messages are read as two newest-first index walks that
+            # SQLite merges, so only about num_messages rows are visited.
+            # A message to oneself is only taken from the received side.
             delivered_sql = """
-                SELECT DISTINCT 
+                SELECT 
                     m.msgid,
                     sender.username AS sender_username, 
                     recipient.username AS recipient_username, 
                     m.message, 
                     m.timestamp
-                FROM 
-                    messages m
+                FROM (
+                    SELECT msgid, senderuuid, recipientuuid, message, timestamp
+                    FROM messages
+                    WHERE recipientuuid = ? AND status = 'delivered'
+                    UNION ALL
+                    SELECT msgid, senderuuid, recipientuuid, message, timestamp
+                    FROM messages
+                    WHERE senderuuid = ?
+                        AND (status = 'pending' OR (status = 'delivered' AND recipientuuid != ?))
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                ) m
                 JOIN 
                     users sender ON m.senderuuid = sender.userid
                 JOIN 
                     users recipient ON m.recipientuuid = recipient.userid
-                WHERE 
-                    (m.status = 'delivered' AND m.recipientuuid = ?)
-                    OR (m.senderuuid = ? AND (m.status = 'delivered' OR m.status = 'pending'))
                 ORDER BY 
-                    m.timestamp DESC
-                LIMIT ?;
+                    m.timestamp DESC;
             """
 
             # count number of pending messages
@@ -510,20 +587,18 @@ class MessageDatabase:
                     AND (recipientuuid = ?);
             """
             cursor = conn.cursor()
-            cursor.execute(delivered_sql, (user_uuid, user_uuid, num_messages))
+            cursor.execute(delivered_sql, (user_uuid, user_uuid, user_uuid, num_messages))
             messages = cursor.fetchall()
-            logger.info(f"messages: {messages}")
+            logger.debug("messages: %s", messages)
             cursor.execute(pending_sql, (user_uuid,))
             pending = cursor.fetchone()[0]
-            logger.info(f"pending: {pending}")
+            logger.debug("pending: %s", pending)
             return [list(message) for message in messages], pending
             
         except sqlite3.Error as e:
             logger.error(f"Error loading messages: {e}")
+            self._rollback()
             return []
-        finally:
-            if conn:
-                conn.close()
 
     def load_page_data(self, user_uuid):
         """For initial load of the data for the main page."""
@@ -542,42 +617,34 @@ class MessageDatabase:
             uuid_counter = {}
             cursor = conn.cursor()
 
-            # First get all UUIDs for the messages
-            for msg_id in msg_ids:
-                cursor.execute("SELECT senderuuid, recipientuuid FROM messages WHERE msgid = ?", (msg_id,))
-                result = cursor.fetchone()
-                if result:
-                    sender_uuid, recipient_uuid = result
-                    # Increment counter for both sender and recipient
-                    uuid_counter[sender_uuid] = uuid_counter.get(sender_uuid, 0) + 1
-                    uuid_counter[recipient_uuid] = uuid_counter.get(recipient_uuid, 0) + 1
-
-            # run deletions
-            for msg_id in msg_ids:
-                cursor.execute("DELETE FROM messages WHERE msgid = ?", (msg_id,))
-                logger.info(f"Deleted message: {msg_id}")
-            conn.commit()  # Commit the transaction before verification
+            if not msg_ids:
+                return []
+            placeholders = ",".join("?" * len(msg_ids))
+
+            # Delete the messages and get back who sent and received each one
+            cursor.execute(
+                "DELETE FROM messages WHERE msgid IN ({}) RETURNING senderuuid, recipientuuid".format(placeholders),
+                msg_ids
+            )
+            deleted = cursor.fetchall()
+            for sender_uuid, recipient_uuid in deleted:
+                # Increment counter for both sender and recipient
+                uuid_counter[sender_uuid] = uuid_counter.get(sender_uuid, 0) + 1
+                uuid_counter[recipient_uuid] = uuid_counter.get(recipient_uuid, 0) + 1
+            num_deleted = len(deleted)
+            conn.commit()
             logger.info(f"Deleted messages: {msg_ids}")
-
-            # verify deletion
-            sql = "SELECT COUNT(msgid) AS num_remaining FROM messages WHERE msgid IN ({})".format(",".join("?" * len(msg_ids)))
-            logger.info(f"SQL: {sql}")
-            cursor.execute(sql, msg_ids)
-            logger.info("Line 460: Checking remaining messages")
-            num_remaining = cursor.fetchone()[0]
-            logger.info(f"Number of messages remaining: {num_remaining}")
+            logger.debug("Number of messages deleted: %s", num_deleted)
 
             # Convert uuid_counter to list of tuples
             uuid_counts = [(uuid, count) for uuid, count in uuid_counter.items()]
-            logger.info(f"UUID deletion counts: {uuid_counts}")
+            logger.debug("UUID deletion counts: %s", uuid_counts)
             return uuid_counts
 
         except sqlite3.Error as e:
             logger.error(f"Error deleting messages: {e}")
+            self._rollback()
             return []
-        finally:
-            if conn:
-                conn.close()
 
     def load_undelivered(self, user_uuid, num_messages):
         """Load the most recent undelivered messages for a user."""
@@ -606,8 +673,8 @@ class MessageDatabase:
                     m.timestamp DESC
                 LIMIT ?;
             """
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             cursor.execute(sql, (user_uuid, num_messages))
             messages = cursor.fetchall()
 
@@ -619,7 +686,5 @@ class MessageDatabase:
 
         except sqlite3.Error as e:
             logger.error(f"Error loading undelivered messages: {e}")
+            self._rollback()
             return []
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
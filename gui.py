@@ -1,6 +1,6 @@
+import collections
 import datetime
 import hashlib
-import threading
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
 from logger import set_logger
@@ -9,28 +9,34 @@ logger = set_logger("gui", "gui.log")
 
 # GUI Setup
 class ClientGUI:
-    def __init__(self, master, send_to_server, network_thread):
+    def __init__(self, master, send_to_server):
         self.master = master
         self.master.title("Client Application")
         self.send_to_server = send_to_server
-        self.network_thread = network_thread
         
         self.user_uuid = None
         self.selected_account = None
         self.username = ""
         self.current_page = 0
         self.max_accounts_page = 0
+        self.accounts_per_page = 10  # Page size used by the server's account search
         self.num_messages = 10
         self.num_undelivered = 0
+        self.max_chat_messages = 2000  # Most recent chat messages kept in message_display
         self.msgid_map = {}  # Dictionary to map listbox indices to msgid
+        self._accounts_shown = []  # Rows currently in accounts_listbox
+        self._messages_shown = []  # Rows currently in messages_listbox
 
         self.login_frame = tk.Frame(master)
         self.chat_frame = tk.Frame(master)
         self.create_account_frame = tk.Frame(master)
         self.register_frame = tk.Frame(master)
         self.error_frame = tk.Frame(master)
-        self.is_threading = False
         self.duplicated_password = False
+        self._pages_built = {}  # Pages whose widgets are built once and reused
+        # Responses from the network thread waiting for the Tk thread
+        self._pending_responses = collections.deque()
+        self._responses_scheduled = False
 
         self.create_login_page()
 
@@ -47,24 +53,30 @@ class ClientGUI:
 
     def create_error_page(self, error_message):
         self.clear_frame(self.login_frame)
-        self.clear_frame(self.chat_frame)
+        self.chat_frame.pack_forget()
         self.clear_frame(self.create_account_frame)
         self.clear_frame(self.register_frame)
         self.error_frame.pack()
 
+        # Built once; later errors only swap the message text
+        if self._pages_built.get("error"):
+            self.error_message_label.config(text=error_message)
+            return
+        self._pages_built["error"] = True
+
         self.error_label = tk.Label(self.error_frame, text="Error", fg="red", font=("Helvetica", 16))
         self.error_label.pack(padx=10, pady=10)
 
         self.error_message_label = tk.Label(self.error_frame, text=error_message, wraplength=400)
         self.error_message_label.pack(padx=10, pady=10)
 
-        self.back_button = tk.Button(self.error_frame, text="Back", command=self.create_login_page)
-        self.back_button.pack(padx=10, pady=10)
+        self.error_back_button = tk.Button(self.error_frame, text="Back", command=self.create_login_page)
+        self.error_back_button.pack(padx=10, pady=10)
 
     def create_account_page(self):
-        self.clear_frame(self.chat_frame)
+        self.chat_frame.pack_forget()
         self.clear_frame(self.login_frame)
-        self.clear_frame(self.error_frame)
+        self.error_frame.pack_forget()
         self.clear_frame(self.register_frame)
 
         self.create_account_frame.pack()
@@ -85,9 +97,9 @@ class ClientGUI:
         self.back_button.pack(padx=10, pady=5)
 
     def create_register_page(self):
-        self.clear_frame(self.chat_frame)
+        self.chat_frame.pack_forget()
         self.clear_frame(self.login_frame)
-        self.clear_frame(self.error_frame)
+        self.error_frame.pack_forget()
         self.clear_frame(self.create_account_frame)
 
         self.register_frame.pack()
@@ -114,8 +126,8 @@ class ClientGUI:
         self.back_button.pack(padx=10, pady=5)
 
     def create_login_page(self):
-        self.clear_frame(self.chat_frame)
-        self.clear_frame(self.error_frame)
+        self.chat_frame.pack_forget()
+        self.error_frame.pack_forget()
         self.clear_frame(self.create_account_frame)
         self.clear_frame(self.register_frame)
 
@@ -145,11 +157,33 @@ class ClientGUI:
 
     def create_chat_page(self):
         self.clear_frame(self.login_frame)
-        self.clear_frame(self.error_frame)
+        self.error_frame.pack_forget()
         self.clear_frame(self.create_account_frame)
         self.clear_frame(self.register_frame)
         self.chat_frame.pack(fill=tk.BOTH, expand=True)
 
+        # The chat widgets are built on first use and reused afterwards
+        if not self._pages_built.get("chat"):
+            self.build_chat_page()
+            self._pages_built["chat"] = True
+        else:
+            # Start the new session from a clean page, not the last user's view
+            self.messages_label.config(text=self.username + "'s messages")
+            self.search_bar.delete(0, tk.END)
+            self.num_messages_entry.delete(0, tk.END)
+            self.entry.delete(0, tk.END)
+            self.accounts_listbox.selection_clear(0, tk.END)
+            self.messages_listbox.selection_clear(0, tk.END)
+            self.current_page = 0
+            self.max_accounts_page = 0
+            self.num_messages = 10
+            self.selected_account = None
+            self.update_message_input_area()
+
+        # Load initial data
+        self.load_page_data()
+
+    def build_chat_page(self):
         # First column: Accounts list with search bar and pagination
         self.accounts_frame = tk.Frame(self.chat_frame)
         self.accounts_frame.grid(row=0, column=0, sticky="nsew")
@@ -239,9 +273,6 @@ class ClientGUI:
         self.chat_frame.grid_columnconfigure(1, weight=1)
         self.chat_frame.grid_columnconfigure(2, weight=1)
         self.chat_frame.grid_rowconfigure(0, weight=1)
-
-        # Load initial data
-        self.load_page_data()
     
     def create_confirm_delete_account_page(self):
         # Create a dialog window
@@ -292,11 +323,24 @@ class ClientGUI:
             self.current_page += 1
             self.search_accounts()
 
+    def update_pagination(self, total_count, page_len):
+        """Work out the last accounts page and enable/disable Prev/Next."""
+        # Pages start from 0; a partial last page still counts as a page
+        per_page = self.accounts_per_page
+        self.max_accounts_page = max(0, (total_count + per_page - 1) // per_page - 1)
+        # A short page is the last one, even if total_count is stale
+        if page_len < per_page:
+            self.max_accounts_page = min(self.max_accounts_page, self.current_page)
+
+        self.prev_button["state"] = tk.NORMAL if self.current_page > 0 else tk.DISABLED
+        self.next_button["state"] = tk.NORMAL if self.current_page < self.max_accounts_page else tk.DISABLED
+
     def on_account_select(self, event):
         selection = event.widget.curselection()
         if selection:
             index = selection[0]
-            self.selected_account = event.widget.get(index)
+            # Read the username from our copy of the rows, not back from Tk
+            self.selected_account = self._accounts_shown[index]
             self.update_message_input_area()
     
     def load_more_messages(self):
@@ -323,19 +367,41 @@ class ClientGUI:
                 "other_username": self.selected_account
             }
         }
-        self.thread_send(request)
+        self.send_to_server(request)
         self.message_display.config(state=tk.DISABLED)
 
+    def sync_listbox(self, listbox, shown, rows):
+        """Make listbox show rows, touching only the entries that changed.
+
+        Returns the new list of shown rows.
+        """
+        if rows == shown:
+            return shown
+        # Skip the rows that already match at either end, then replace the
+        # changed middle with one delete and one insert. A new message at
+        # the top of a newest-first page costs two Tk calls, not one per row.
+        common = min(len(shown), len(rows))
+        head = 0
+        while head < common and shown[head] == rows[head]:
+            head += 1
+        tail = 0
+        while tail < common - head and shown[-1 - tail] == rows[-1 - tail]:
+            tail += 1
+        if len(shown) - tail > head:
+            listbox.delete(head, len(shown) - tail - 1)
+        if len(rows) - tail > head:
+            listbox.insert(head, *rows[head:len(rows) - tail])
+        return list(rows)
+
     def update_accounts_list(self, accounts):
-        self.accounts_listbox.delete(0, tk.END)
-        for account in accounts:
-            # Display username in the listbox
-            self.accounts_listbox.insert(tk.END, account[1])
+        # Display usernames in the listbox
+        usernames = [account[1] for account in accounts]
+        self._accounts_shown = self.sync_listbox(self.accounts_listbox, self._accounts_shown, usernames)
 
     def update_messages_list(self, messages, total_undelivered):
         logger.info(f"Updating messages list with {len(messages)} messages")
-        self.messages_listbox.delete(0, tk.END)
         self.msgid_map.clear()  # Clear the previous mapping
+        rows = []
         for index, message in enumerate(messages):
             sender = message[1]
             recipient = message[2]
@@ -349,7 +415,8 @@ class ClientGUI:
             else:
                 display_text = f"To {recipient}: {msg_content}"
             
-            self.messages_listbox.insert(tk.END, display_text)
+            rows.append(display_text)
+        self._messages_shown = self.sync_listbox(self.messages_listbox, self._messages_shown, rows)
         self.undelivered_label.config(text=f"Undelivered messages: {total_undelivered}")
         self.go_button.config(state=tk.NORMAL if total_undelivered > 0 else tk.DISABLED)
 
@@ -360,21 +427,6 @@ class ClientGUI:
     # ===================================================================
     # ===================================================================
 
-    def thread_send(self, request, callback=None):
-        """Send a request to the server using a separate thread to reduce GUI lag.
-        
-        Args:
-            request: The request to send to the server
-            callback: Optional function to call after the request is processed
-        """
-        def send_with_callback():
-            self.send_to_server(request)
-            if callback:
-                self.master.after(100, callback)  # Schedule callback on main thread after 100ms
-                
-        thread = threading.Thread(target=send_with_callback)
-        thread.start()
-
     def check_username(self): 
         logger.info(f"F {self.username}: Check username")
         username = self.username_entry.get()
@@ -384,13 +436,7 @@ class ClientGUI:
             "action": "check_username",
             "content": {"username": username},
         }
-        if not self.is_threading:
-            self.is_threading = True
-            threading.Thread(target=lambda: self.network_thread(request), daemon=True).start()
-        else:
-            self.thread_send(request)
-
-        self.thread_send(request)
+        self.send_to_server(request)
 
     def register(self):
         logger.info(f"F {self.username}: Register")
@@ -401,7 +447,7 @@ class ClientGUI:
                 "action": "register",
                 "content": {"username": username, "password": self.hash_password(password)},
             }
-            self.thread_send(request)
+            self.send_to_server(request)
 
     def load_page_data(self):
         logger.info(f"F {self.username}: Load page data")
@@ -409,16 +455,16 @@ class ClientGUI:
             "action": "load_page_data",
             "content": {"uuid": self.user_uuid},
         }
-        self.thread_send(request)
+        self.send_to_server(request)
 
     def search_accounts(self):
         logger.info(f"F {self.username}: Searching accounts")
         search_term = self.search_bar.get().lower()
         request = {
             "action": "search_accounts",
-            "content": {"search_term": search_term, "offset": self.current_page * 10},
+            "content": {"search_term": search_term, "offset": self.current_page * self.accounts_per_page},
         }
-        self.thread_send(request)
+        self.send_to_server(request)
 
     def delete_messages(self):
         logger.info(f"F {self.username}: Delete messages")
@@ -428,7 +474,7 @@ class ClientGUI:
             "action": "delete_messages",
             "content": {"msgids": selected_msgids, "deleter_uuid": self.user_uuid},
         }
-        self.thread_send(request)
+        self.send_to_server(request)
 
     def load_undelivered_messages(self):
         logger.info(f"F {self.username}: Load undelivered messages")
@@ -440,7 +486,7 @@ class ClientGUI:
             "action": "load_undelivered",
             "content": {"num_messages": num_messages, "uuid": self.user_uuid},
         }
-        self.thread_send(request)
+        self.send_to_server(request)
 
 
     def load_messages(self):
@@ -451,7 +497,7 @@ class ClientGUI:
             "action": "load_messages",
             "content": {"num_messages": num_messages, "uuid": self.user_uuid},
         }
-        self.thread_send(request)
+        self.send_to_server(request)
 
 
     def send_message(self):
@@ -466,7 +512,7 @@ class ClientGUI:
                 "action": "send_message",
                 "content": {"uuid": self.user_uuid, "recipient_username": self.selected_account, "message": msg, "timestamp": timestamp},
             }
-            self.thread_send(request)
+            self.send_to_server(request)
 
     def login(self):
         logger.info(f"F {self.username}: Login")
@@ -478,11 +524,7 @@ class ClientGUI:
                 "content": {"username": username, "password": self.hash_password(password)},
             }
             self.username = username
-            if not self.is_threading:
-                self.is_threading = True
-                threading.Thread(target=lambda: self.network_thread(request), daemon=True).start()
-            else:
-                self.thread_send(request)
+            self.send_to_server(request)
 
 
     def delete_account(self):
@@ -495,7 +537,7 @@ class ClientGUI:
                 "password": self.hash_password(password),
             }
         }
-        self.thread_send(request)
+        self.send_to_server(request)
 
 
     # ===================================================================
@@ -503,9 +545,28 @@ class ClientGUI:
     # Server response handling
     # ===================================================================
     # ===================================================================
+    def queue_server_response(self, response, response_type):
+        """Hand a server response to the Tk thread (called from the network thread).
+
+        Responses arriving in a burst share a single Tk callback.
+        """
+        self._pending_responses.append((response, response_type))
+        if not self._responses_scheduled:
+            self._responses_scheduled = True
+            self.master.after(0, self.drain_server_responses)
+
+    def drain_server_responses(self):
+        """Handle every queued server response (Tk thread)."""
+        # Clear first so a response queued while draining schedules a new drain
+        self._responses_scheduled = False
+        pending = self._pending_responses
+        handle = self.handle_server_response
+        while pending:
+            handle(*pending.popleft())
+
     def handle_server_response(self, response, response_type):
         # response_type = response["response_type"]
-        logger.info(f"Action: {response_type}, Response: {response}")
+        logger.debug("Action: %s, Response: %s", response_type, response)
         
         if response_type == "delete_account_r":
             if response["success"]:
@@ -527,21 +588,13 @@ class ClientGUI:
 
         elif response_type == "load_page_data_r":
             accounts = response.get("accounts", [])
+            self.update_pagination(response.get("total_count", 0), len(accounts))
             accounts = [acc for acc in accounts if acc[1] != self.username]
             messages = response.get("messages", [])
             total_undelivered = response.get("num_pending", 0)
-            total_count = response.get("total_count", 0)
             
             self.num_messages = len(messages)
             self.num_undelivered = total_undelivered
-            
-            # Update pagination state. Start index from 0
-            self.max_accounts_page = (total_count // 10)
-            
-            # Enable/disable pagination buttons
-            self.prev_button["state"] = tk.NORMAL if self.current_page > 0 else tk.DISABLED
-            self.next_button["state"] = tk.NORMAL if self.current_page < self.max_accounts_page else tk.DISABLED
-
 
             self.update_accounts_list(accounts)
             self.update_messages_list(messages, total_undelivered)
@@ -553,19 +606,13 @@ class ClientGUI:
         elif response_type == "search_accounts_r":
             accounts = response.get("accounts", [])
             total_count = response.get("total_count", 0)
-            logger.info(f"Received {len(accounts)} accounts (total: {total_count}) accounts: {accounts}")
+            logger.debug("Received %d accounts (total: %d) accounts: %s", len(accounts), total_count, accounts)
             accounts = [acc for acc in accounts if acc[1] != self.username]
-            logger.info(f"Accounts without self: {accounts}")
+            logger.debug("Accounts without self: %s", accounts)
             
             # Update the accounts list
             self.update_accounts_list(accounts)
-            
-            # Update pagination state. Start index from 0
-            self.max_accounts_page = (total_count // 10)
-            
-            # Enable/disable pagination buttons
-            self.prev_button["state"] = tk.NORMAL if self.current_page > 0 else tk.DISABLED
-            self.next_button["state"] = tk.NORMAL if self.current_page < self.max_accounts_page else tk.DISABLED
+            self.update_pagination(total_count, len(response.get("accounts", [])))
             
         elif response_type == "receive_message_r":            
             sender = response.get("sender_username", "Unknown")
@@ -574,7 +621,7 @@ class ClientGUI:
             self.num_messages += 1
 
             # update the messagelist box
-            self.master.after(500, self.load_messages())
+            self.load_messages()
             if sender == self.selected_account:
                 self.master.after(1000, self.update_message_input_area)
         
@@ -658,7 +705,8 @@ class ClientGUI:
             header_end = "3.0"  # After "Your chat with username\n\n\n"
             self.message_display.delete(header_end, tk.END)
             
-            # Display messages
+            # Display messages, built up and inserted with a single Tk call
+            lines = []
             for msg in messages:
                 if msg["status"] == "pending" and msg["recipient_username"] == self.username:
                     logger.info(f"Skipping pending message from {msg['sender_username']}: {msg['message']}")
@@ -668,7 +716,11 @@ class ClientGUI:
                 message = msg["message"]
                 
                 # Format: [timestamp] sender: message
-                self.message_display.insert(tk.END, f"[{timestamp}] {sender}: {message}\n")
+                lines.append(f"[{timestamp}] {sender}: {message}\n")
+            # Only the newest messages are shown so the Text widget stays small
+            del lines[:-self.max_chat_messages]
+            if lines:
+                self.message_display.insert(tk.END, "".join(lines))
             
             self.message_display.config(state=tk.DISABLED)
             # Scroll to bottom
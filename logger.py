@@ -2,10 +2,18 @@ import logging
 import os
 
 def set_logger(name, log_file):
-    """Set up the logger with the given name and log file."""
+    """Set up the logger with the given name and log file.
+
+    The level defaults to INFO; set LOG_LEVEL=DEBUG to also record the
+    per-event wire traffic. An unknown LOG_LEVEL falls back to INFO.
+    """
     # Set up logging
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)  # Capture all levels
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    # getLevelName maps known names to their number and anything else to a string
+    if not isinstance(logging.getLevelName(level), int):
+        level = logging.INFO
+    logger.setLevel(level)
 
     # Create logs directory if it doesn't exist
     os.makedirs('logs', exist_ok=True)
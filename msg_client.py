@@ -1,12 +1,29 @@
-import io
 import json
 import selectors
 import struct
 from custom_protocol_2 import CustomProtocol
 from logger import set_logger
 
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib json module
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed for the "msgpack" protocol
+    msgpack = None
+
 logger = set_logger('msg_client', 'msg_client.log')
 
+# Protocol byte sent in the protoheader for each mode. Anything the server
+# sends other than 0 (json) or 3 (msgpack) is treated as custom.
+PROTOCOL_NUMS = {"json": 0, "custom": 1, "msgpack": 3}
+
+# Large enough that a full page of search_accounts/load_page_data results
+# normally arrives in one read instead of several wakeups.
+RECV_BUFSIZE = 16384
+
 
 class Message:
     def __init__(self, selector, sock, addr, gui, request, protocol):
@@ -15,8 +32,12 @@ class Message:
         self.addr = addr
         self.request = request
         self.gui = gui
-        self._recv_buffer = b""
-        self._send_buffer = b""
+        self._recv_buffer = bytearray()
+        # Queued frames are appended in place and go out in one send()
+        self._send_buffer = bytearray()
+        # Reused for every recv so reads don't allocate a new bytes object
+        self._rx_buf = bytearray(RECV_BUFSIZE)
+        self._rx_view = memoryview(self._rx_buf)
         self._request_queued = False
         self._header_len = None
         self.header = None
@@ -26,7 +47,7 @@ class Message:
         self.version = 1
 
         # validate protocol_mode: if unknown protocol, do not assume
-        if self.protocol_mode not in ["json", "custom"]:
+        if self.protocol_mode not in ["json", "custom", "msgpack"]:
             return ValueError(f"Invalid protocol mode {self.protocol_mode!r}.")
 
     def _set_selector_events_mask(self, mode):
@@ -45,13 +66,13 @@ class Message:
         """Read from the socket."""
         try:
             # Should be ready to read
-            data = self.sock.recv(4096)
+            nbytes = self.sock.recv_into(self._rx_buf)
         except BlockingIOError:
             # Resource temporarily unavailable (errno EWOULDBLOCK)
             pass
         else:
-            if data:
-                self._recv_buffer += data
+            if nbytes:
+                self._recv_buffer += self._rx_view[:nbytes]
             else:
                 raise RuntimeError("Peer closed.")
 
@@ -59,7 +80,7 @@ class Message:
         """Write to the socket."""
         # logger.info("Writing to socket")
         if self._send_buffer:
-            logger.info(f"Sending {self._send_buffer!r} to {self.addr}")
+            logger.debug("Sending %r to %s", self._send_buffer, self.addr)
             try:
                 # Should be ready to write
                 sent = self.sock.send(self._send_buffer)
@@ -68,25 +89,30 @@ class Message:
                 pass
             else:
                 self._send_buffer = self._send_buffer[sent:]
+                # Only the send side is done here: a response may be partly
+                # read, and process_response resets the read state
                 if sent and not self._send_buffer:
-                    self._header_len = None
-                    self.header = None
                     self.request = None
-                    self.response_created = False
 
     def _json_encode(self, obj, encoding):
         """Encode a Python object as JSON and encode to bytes."""
+        if orjson is not None and encoding == "utf-8":
+            return orjson.dumps(obj)
         return json.dumps(obj, ensure_ascii=False).encode(encoding)
 
     def _json_decode(self, json_bytes, encoding):
         """Decode JSON bytes to a Python object."""
-        tiow = io.TextIOWrapper(
-            io.BytesIO(json_bytes), encoding=encoding, newline=""
-        )
-        obj = json.load(tiow)
-        tiow.close()
-        return obj
+        if orjson is not None and encoding == "utf-8":
+            return orjson.loads(json_bytes)
+        return json.loads(bytes(json_bytes).decode(encoding))
+
+    def _msgpack_encode(self, obj):
+        """Encode a Python object as msgpack bytes."""
+        return msgpack.packb(obj, use_bin_type=True)
 
+    def _msgpack_decode(self, msgpack_bytes):
+        """Decode msgpack bytes to a Python object."""
+        return msgpack.unpackb(bytes(msgpack_bytes), raw=False)
 
     def _create_message(
         self, *, content_bytes, action, content_length
@@ -101,47 +127,64 @@ class Message:
             header_bytes = self._json_encode(header, "utf-8")
         elif self.protocol_mode == "custom":
             checksum = self.custom_protocol.compute_checksum(content_bytes)
-            header["checksum"] = checksum
-            header_bytes = self.custom_protocol.serialize(header)
+            header_bytes = self.custom_protocol.serialize_header(action, content_length, checksum)
+        elif self.protocol_mode == "msgpack":
+            header_bytes = self._msgpack_encode(header)
         # Pack version (1 byte) and header length (2 bytes)
-        protocol_num = 0 if self.protocol_mode == "json" else 1
+        protocol_num = PROTOCOL_NUMS[self.protocol_mode]
         message_hdr = struct.pack(">BBH", self.version, protocol_num, len(header_bytes))
         message = message_hdr + header_bytes + content_bytes
-        logger.info(f"Created message: {message!r}")
+        logger.debug("Created message: %r", message)
         return message
 
     def process_events(self, mask):
-        """Process selector events (step 1 of processing)"""
+        """Process selector events (step 1 of processing)
+
+        A lost connection (the peer closing, or a socket error) is raised
+        to the caller so it can close this Message. Other errors are logged.
+        """
         if mask & selectors.EVENT_READ:
             # logger.debug("Read event received")
             try:
                 self.read()
+            except (RuntimeError, OSError):
+                raise
             except Exception as e:
                 logger.error(f"Error during read: {e}")
         if mask & selectors.EVENT_WRITE:
             # logger.debug("Write event received")
             try:
                 self.write()
+            except (RuntimeError, OSError):
+                raise
             except Exception as e:
                 logger.error(f"Error during write: {e}")
 
     def read(self):
         """Read response pipeline"""
         self._read()
-        logger.info(f"Read data from {self.addr}: {self._recv_buffer!r}")
+        logger.debug("Read data from %s: %r", self.addr, self._recv_buffer)
 
-        if self._header_len is None:
-            self.process_protoheader()
-            # logger.info(f"Read protoheader, new data: {self._recv_buffer!r}")
+        # One recv can carry several responses; handle every complete one
+        while True:
+            buffered = len(self._recv_buffer)
 
-        if self._header_len is not None:
-            if self.header is None:
-                self.process_header()
-                # logger.info(f"Read header, new data: {self._recv_buffer!r}")
+            if self._header_len is None:
+                self.process_protoheader()
+                # logger.info(f"Read protoheader, new data: {self._recv_buffer!r}")
 
-        if self.header:
-            if self.response is None:
-                self.process_response()
+            if self._header_len is not None:
+                if self.header is None:
+                    self.process_header()
+                    # logger.info(f"Read header, new data: {self._recv_buffer!r}")
+
+            if self.header:
+                if self.response is None:
+                    self.process_response()
+
+            # Stop once a frame is incomplete or nothing was consumed
+            if self.header is not None or len(self._recv_buffer) in (0, buffered):
+                break
 
     def write(self):
         """Write request pipeline"""
@@ -171,16 +214,23 @@ class Message:
             # Delete reference to socket object for garbage collection
             self.sock = None
 
-    def queue_request(self):
-        """Prepare a request to be sent to the server."""
-        # Reset state before queuing a new request
-        self.reset_state()
-        
+    def queue_request(self, request=None):
+        """Prepare a request to be sent to the server.
+
+        Frames accumulate in the send buffer, so several requests queued
+        between writes go out in a single send(). The read state is left
+        alone: a response to an earlier request may be partly received.
+        """
+        if request is not None:
+            self.request = request
+
         # Serialize the content
         if self.protocol_mode == "json":
             content = self._json_encode(self.request["content"], "utf-8")
         elif self.protocol_mode == "custom":
-            content = self.custom_protocol.serialize(self.request["content"])
+            content = self.custom_protocol.serialize(self.request["content"], self.request["action"])
+        elif self.protocol_mode == "msgpack":
+            content = self._msgpack_encode(self.request["content"])
         
         # Create the message
         action = self.request["action"]
@@ -189,26 +239,31 @@ class Message:
             "action": action,
             "content_length": len(content),
         }
-        logger.info(f"Queing request: {req!r}")
+        logger.debug("Queing request: %r", req)
         message = self._create_message(**req)
         self._send_buffer += message
         self._request_queued = True
 
     def process_protoheader(self):
         """Process the protocol header (read pipeline step 1)."""
-        logger.info("Processing protocol header")
+        logger.debug("Processing protocol header")
         version_len = 1  # 1 byte for version
         protocol_len = 1  # 1 byte for protocol type
         hdrlen = 2  # fixed length for header length
         
-        # First check version
-        if len(self._recv_buffer) >= (version_len + protocol_len):
+        # First check version (wait for the whole protoheader)
+        if len(self._recv_buffer) >= (version_len + protocol_len + hdrlen):
             version = struct.unpack(">B", self._recv_buffer[:version_len])[0]
             if version != self.version:
                 raise ValueError(f"Cannot handle protocol version {version}")
             self._recv_buffer = self._recv_buffer[version_len:]
             server_protocol_num = struct.unpack(">B", self._recv_buffer[:protocol_len])[0]
-            server_protocol = "json" if server_protocol_num == 0 else "custom"
+            if server_protocol_num == PROTOCOL_NUMS["json"]:
+                server_protocol = "json"
+            elif server_protocol_num == PROTOCOL_NUMS["msgpack"]:
+                server_protocol = "msgpack"
+            else:
+                server_protocol = "custom"
             if server_protocol != self.protocol_mode:
                 raise ValueError(f"Cannot handle protocol type {server_protocol_num}")
             self._recv_buffer = self._recv_buffer[protocol_len:]
@@ -237,11 +292,13 @@ class Message:
                 self.header = self.custom_protocol.deserialize(
                     self._recv_buffer[:hdrlen], "header"
                 )
+            elif self.protocol_mode == "msgpack":
+                self.header = self._msgpack_decode(self._recv_buffer[:hdrlen])
             else:
                 raise ValueError(f"Invalid protocol mode {self.protocol_mode!r}")
             
             # verify header
-            logger.info(f"JSON header: {self.header!r}")
+            logger.debug("JSON header: %r", self.header)
             self._recv_buffer = self._recv_buffer[hdrlen:]
             for reqhdr in (
                 "content-length",
@@ -256,7 +313,7 @@ class Message:
         self._header_len = None
         self.header = None
         self.response = None
-        self._recv_buffer = b""
+        self._recv_buffer = bytearray()
 
     def process_response(self):
         """Process the response (read pipeline step 3)."""
@@ -280,12 +337,17 @@ class Message:
                 computed_checksum = self.custom_protocol.compute_checksum(data)
                 if computed_checksum != self.header["checksum"]:
                     action = "error"
-            logger.info(f"Decoded response: {decoded_response}")
+            elif self.protocol_mode == "msgpack":
+                decoded_response = self._msgpack_decode(data)
+            logger.debug("Decoded response: %s", decoded_response)
             self.response = decoded_response
-            # Server response in gui
-            self.gui.handle_server_response(decoded_response, action)
-            # Done reading, reset Message class for next message
-            self.reset_state()
+            # Server response in gui (handled on the Tk thread)
+            self.gui.queue_server_response(decoded_response, action)
+            # Done reading, reset for the next message but keep any bytes
+            # of it that already arrived
+            self._header_len = None
+            self.header = None
+            self.response = None
         except Exception as e:
             logger.error(f"Error decoding response: {e}")
             logger.error(f"Raw data that caused error: {data}")
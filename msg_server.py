@@ -6,8 +6,17 @@ from database import MessageDatabase
 from custom_protocol_2 import CustomProtocol
 from logger import set_logger
 
+try:
+    import msgpack
+except ImportError:  # optional: only needed for the "msgpack" protocol
+    msgpack = None
+
 logger = set_logger("msg_server", "msg_server.log")
 
+# Protocol byte sent in the protoheader for each mode. Anything a client
+# sends other than 0 (json) or 3 (msgpack) is treated as custom.
+PROTOCOL_NUMS = {"json": 0, "custom": 2, "msgpack": 3}
+
 db = MessageDatabase()
 
 class Message:
@@ -26,7 +35,7 @@ class Message:
         self.accepted_versions = accepted_versions
 
         # validate protocol_mode: if unknown protocol, do not assume
-        if self.protocol_mode not in ["json", "custom"]:
+        if self.protocol_mode not in ["json", "custom", "msgpack"]:
             return ValueError(f"Invalid protocol mode {self.protocol_mode!r}.")
 
     def _unicast(self, recipient_socket, message):
@@ -83,7 +92,7 @@ class Message:
     def _write(self):
         """Write to the client socket"""
         if self._send_buffer:
-            logger.info(f"Sending {self._send_buffer!r} to {self.addr}")
+            logger.debug("Sending %r to %s", self._send_buffer, self.addr)
             try:
                 # Should be ready to write
                 sent = self.sock.send(self._send_buffer)
@@ -99,6 +108,9 @@ class Message:
                     self.request = None
                     self.response_created = False
                     self._set_selector_events_mask("r")
+                    # The client may have pipelined more requests behind this one
+                    if self._recv_buffer:
+                        self._process_recv_buffer()
 
     def _json_encode(self, obj, encoding):
         """Encode a JSON object and return bytes"""
@@ -113,6 +125,22 @@ class Message:
         tiow.close()
         return obj
 
+    def _msgpack_encode(self, obj):
+        """Encode a Python object as msgpack bytes"""
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def _msgpack_decode(self, msgpack_bytes):
+        """Decode msgpack bytes and return a Python object"""
+        return msgpack.unpackb(msgpack_bytes, raw=False)
+
+    def _encode_content(self, content, action=None):
+        """Encode message content for this connection's protocol"""
+        if self.protocol_mode == "json":
+            return self._json_encode(content, "utf-8")
+        elif self.protocol_mode == "msgpack":
+            return self._msgpack_encode(content)
+        return self.custom_protocol.serialize(content, action)
+
     def _create_message(
         self, *, content_bytes, action, content_length
     ):
@@ -126,11 +154,12 @@ class Message:
             header_bytes = self._json_encode(header, "utf-8")
         elif self.protocol_mode == "custom":
             checksum = self.custom_protocol.compute_checksum(content_bytes)
-            header["checksum"] = checksum
-            header_bytes = self.custom_protocol.serialize(header)
+            header_bytes = self.custom_protocol.serialize_header(action, content_length, checksum)
+        elif self.protocol_mode == "msgpack":
+            header_bytes = self._msgpack_encode(header)
         
         # Pack version (1 byte), protocol type, and header length (2 bytes)
-        protocol_byte = 0 if self.protocol_mode == "json" else 2
+        protocol_byte = PROTOCOL_NUMS[self.protocol_mode]
         message_hdr = struct.pack(">BBH", 1, protocol_byte, len(header_bytes))
         message = message_hdr + header_bytes + content_bytes
         return message
@@ -169,6 +198,8 @@ class Message:
             computed_checksum = self.custom_protocol.compute_checksum(self.request)
             if computed_checksum != self.header.get("checksum") or not request_content:
                 self.header["action"] = "error"
+        elif self.protocol_mode == "msgpack":
+            request_content = self._msgpack_decode(self.request)
 
         # Check fields in request are there
         if not self.check_fields(self.header["action"], request_content):
@@ -176,12 +207,12 @@ class Message:
 
         response_content = {}
         action = "error"
-        logger.info(f"action: {self.header['action']}")
+        logger.debug("action: %s", self.header['action'])
         # Create response content and encode it
         if self.header["action"] == "login":
             # try to login
             accounts = db.login(request_content.get("username"), request_content.get("password"), str(self.addr))
-            logger.info(f"Account lookup result: {accounts}")
+            logger.debug("Account lookup result: %s", accounts)
             if (len(accounts) != 1):
                 response_content = {
                     "message": "An account with that username and password doesn't exist.",
@@ -222,10 +253,7 @@ class Message:
                 refresh_content = {
                     "message": "Account created"
                 }
-                if self.protocol_mode == "json":
-                    refresh_content_bytes = self._json_encode(refresh_content, "utf-8")
-                else:
-                    refresh_content_bytes = self.custom_protocol.serialize(refresh_content)
+                refresh_content_bytes = self._encode_content(refresh_content, "refresh_accounts_r")
                 
                 refresh_message = self._create_message(
                     content_bytes=refresh_content_bytes,
@@ -261,7 +289,7 @@ class Message:
             
             # Search for accounts with pagination
             accounts, total_count = db.search_accounts(search_term, offset)
-            logger.info(f"Found {len(accounts)} accounts (total: {total_count})")
+            logger.debug("Found %s accounts (total: %s)", len(accounts), total_count)
             
             response_content = {
                 "accounts": accounts,
@@ -271,10 +299,10 @@ class Message:
         elif self.header["action"] == "load_messages":
             user_uuid = request_content.get("uuid")
             num_messages = request_content.get("num_messages")
-            logger.info(f"Loading messages for user {user_uuid} and num_messages {num_messages}")
+            logger.debug("Loading messages for user %s and num_messages %s", user_uuid, num_messages)
             
             messages, total_undelivered = db.load_messages(user_uuid, num_messages)
-            logger.info(f"Found {len(messages)} messages (total: {total_undelivered})")
+            logger.debug("Found %s messages (total: %s)", len(messages), total_undelivered)
             
             response_content = {
                 "messages": messages,
@@ -288,7 +316,7 @@ class Message:
             message_text = request_content.get("message")
             timestamp = request_content.get("timestamp")
 
-            logger.info(f"Message details - Sender: {sender_uuid}, Recipient: {recipient_username}, Message: {message_text}, Time: {timestamp}")
+            logger.debug("Message details - Sender: %s, Recipient: %s, Message: %s, Time: %s", sender_uuid, recipient_username, message_text, timestamp)
             
             # Get recipient's UUID
             success_status, error_msg, recipient_uuid = db.get_user_uuid(recipient_username)
@@ -311,10 +339,7 @@ class Message:
                     }
                     
                     # Convert content to bytes for sending
-                    if self.protocol_mode == "json":
-                        relay_content_bytes = self._json_encode(relay_content, "utf-8")
-                    elif self.protocol_mode == "custom":
-                        relay_content_bytes = self.custom_protocol.serialize(relay_content)
+                    relay_content_bytes = self._encode_content(relay_content, "receive_message_r")
                     
                     relay_message = self._create_message(
                         content_bytes=relay_content_bytes,
@@ -336,11 +361,11 @@ class Message:
         elif self.header["action"] == "load_undelivered":
             user_uuid = request_content.get("uuid", None)
             num_messages = request_content.get("num_messages", 0)
-            logger.info(f"Loading undelivered messages for user {user_uuid}")
+            logger.debug("Loading undelivered messages for user %s", user_uuid)
             
             # Load undelivered messages from db
             messages = db.load_undelivered(user_uuid, num_messages)
-            logger.info(f"Found {len(messages)} undelivered messages")
+            logger.debug("Found %s undelivered messages", len(messages))
             
             response_content = {
                 "messages": messages,
@@ -348,11 +373,11 @@ class Message:
             action = "load_undelivered_r"
         elif self.header["action"] == "delete_messages":
             msg_ids = request_content.get("msgids", [])
-            logger.info(f"msg_ids: {msg_ids}")
+            logger.debug("msg_ids: %s", msg_ids)
             deleter_uuid = request_content.get("deleter_uuid", None)
-            logger.info(f"deleter_uuid: {deleter_uuid}")
+            logger.debug("deleter_uuid: %s", deleter_uuid)
             delete_messages_result = db.delete_messages(msg_ids)
-            logger.info(f"delete_messages_result: {delete_messages_result}")
+            logger.debug("delete_messages_result: %s", delete_messages_result)
             deleter_num_messages = 0
 
             for uuid, num_deleted in delete_messages_result:
@@ -361,7 +386,7 @@ class Message:
                     continue
                 # Get recipient's associated socket
                 recipient_socket = db.get_associated_socket(uuid)
-                logger.info(f"recipient_socket: {recipient_socket}")
+                logger.debug("recipient_socket: %s", recipient_socket)
                 
                 # ensure all fields are there
                 if recipient_socket:
@@ -371,10 +396,7 @@ class Message:
                     }
                     
                     # Convert content to bytes for sending
-                    if self.protocol_mode == "json":
-                        relay_content_bytes = self._json_encode(relay_content, "utf-8")
-                    elif self.protocol_mode == "custom":
-                        relay_content_bytes = self.custom_protocol.serialize(relay_content)
+                    relay_content_bytes = self._encode_content(relay_content, "delete_messages_r")
                     
                     relay_message = self._create_message(
                         content_bytes=relay_content_bytes,
@@ -414,10 +436,7 @@ class Message:
                                                  "success": success,
                                                  "error": error_message}
                                 
-                                if self.protocol_mode == "json":
-                                    notify_content_bytes = self._json_encode(notify_content, "utf-8")
-                                else:
-                                    notify_content_bytes = self.custom_protocol.serialize(notify_content)
+                                notify_content_bytes = self._encode_content(notify_content, "delete_account_refresh_r")
                                     
                                 notify_message = self._create_message(
                                     content_bytes=notify_content_bytes,
@@ -456,10 +475,7 @@ class Message:
             }
             action = "error"
             
-        if self.protocol_mode == "json":
-            content_bytes = self._json_encode(response_content, "utf-8")
-        elif self.protocol_mode == "custom":
-            content_bytes = self.custom_protocol.serialize(response_content)
+        content_bytes = self._encode_content(response_content, action)
             
         response = {
             "content_bytes": content_bytes,
@@ -480,7 +496,10 @@ class Message:
     def read(self):
         """Read data pipeline from the client socket (step 2 if read)"""
         self._read()
+        self._process_recv_buffer()
 
+    def _process_recv_buffer(self):
+        """Advance the read pipeline over whatever is already buffered"""
         if self._header_len is None:
             self.process_protoheader()
 
@@ -526,14 +545,19 @@ class Message:
         protocol_len = 1  # 1 byte for protocol type
         hdrlen = 2  # fixed length for header length
         
-        # First check version
-        if len(self._recv_buffer) >= (version_len + protocol_len):
+        # First check version (wait for the whole protoheader)
+        if len(self._recv_buffer) >= (version_len + protocol_len + hdrlen):
             version = struct.unpack(">B", self._recv_buffer[:version_len])[0]
             if version not in self.accepted_versions:
                 raise ValueError(f"Cannot handle protocol version {version}")
             self._recv_buffer = self._recv_buffer[version_len:]
             client_protocol_num = struct.unpack(">B", self._recv_buffer[:protocol_len])[0]
-            client_protocol = "json" if client_protocol_num == 0 else "custom"
+            if client_protocol_num == PROTOCOL_NUMS["json"]:
+                client_protocol = "json"
+            elif client_protocol_num == PROTOCOL_NUMS["msgpack"]:
+                client_protocol = "msgpack"
+            else:
+                client_protocol = "custom"
             if self.protocol_mode != client_protocol:
                 raise ValueError(f"Client protocol {client_protocol} does not match server protocol {self.protocol_mode}")
             self._recv_buffer = self._recv_buffer[protocol_len:]
@@ -553,7 +577,7 @@ class Message:
 
         if len(self._recv_buffer) >= hdrlen:
             # Validate protocol mode
-            if self.protocol_mode not in ["json", "custom"]:
+            if self.protocol_mode not in ["json", "custom", "msgpack"]:
                 raise ValueError(f"Invalid protocol mode {self.protocol_mode!r}")
 
             # Decode the header based on the protocol mode
@@ -563,6 +587,8 @@ class Message:
                 )
             elif self.protocol_mode == "custom":
                 self.header = self.custom_protocol.deserialize(self._recv_buffer[:hdrlen], "header")
+            elif self.protocol_mode == "msgpack":
+                self.header = self._msgpack_decode(self._recv_buffer[:hdrlen])
             
             self._recv_buffer = self._recv_buffer[hdrlen:]
             # check minimum required fields are present
@@ -580,7 +606,7 @@ class Message:
         data = self._recv_buffer[:content_len]
         self._recv_buffer = self._recv_buffer[content_len:]
         self.request = data
-        logger.info(f"Stored request data: {self.request!r}")
+        logger.debug("Stored request data: %r", self.request)
         # Set selector to listen for write events, we're ready to respond
         self._set_selector_events_mask("w")
 
@@ -1,6 +1,7 @@
 import sys
 import socket
 import selectors
+import msg_server
 from msg_server import Message
 import json
 from logger import set_logger
@@ -77,6 +78,11 @@ def main():
         port = config['port']
         protocol = config['protocol']
         accepted_versions = config['accepted_versions']
+
+        # Fail now rather than on every request
+        if protocol == "msgpack" and msg_server.msgpack is None:
+            print("Error: msgpack protocol requires the msgpack package")
+            sys.exit(1)
         
         # Convert port to int if it's a string
         try:
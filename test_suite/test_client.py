@@ -1,9 +1,13 @@
 import unittest
 from unittest.mock import MagicMock, patch
+import os
+import select
 import selectors
+import socket
 import sys
 import tkinter as tk
 import client
+from msg_client import Message
 
 # to run: python3 -m pytest test_suite/test_client.py -v --cov=client --cov-report=term-missing
 
@@ -31,12 +35,11 @@ class TestClient(unittest.TestCase):
         # Create root window and GUI
         self.root = tk.Tk()
         
-        # Mock send_to_server and network_thread functions
+        # Mock send_to_server function
         self.mock_send_to_server = MagicMock()
-        self.mock_network_thread = MagicMock()
         
         # Create GUI with mock functions
-        self.gui = client.ClientGUI(self.root, self.mock_send_to_server, self.mock_network_thread)
+        self.gui = client.ClientGUI(self.root, self.mock_send_to_server)
         
         # Initialize GUI components that would normally be created in create_chat_page
         self.gui.entry = tk.Entry(self.root)
@@ -87,77 +90,237 @@ class TestClient(unittest.TestCase):
         # Test sending with uninitialized client
         setattr(client, 'sel', None)
         client.send_to_server({"action": "test"})
-        
+        self.assertEqual(len(client.tx_queue), 0)
+
         # Restore selector and test normal sending
         setattr(client, 'sel', self.mock_selector)
-        
-        # Mock Message object
+
+        # Send test request: only queued, the selector is left alone
+        request = {"action": "test_action"}
+        client.wake_pending = False
+        with patch('os.write') as mock_write:
+            client.send_to_server(request)
+            mock_write.assert_called_once_with(client.wake_w, b"\0")
+
+            # A second request before the drain does not write again
+            client.send_to_server(request)
+            mock_write.assert_called_once()
+        self.assertEqual(client.tx_queue.popleft(), request)
+        self.assertEqual(client.tx_queue.popleft(), request)
+        self.mock_selector.modify.assert_not_called()
+
+        # Test exception handling
+        client.wake_pending = False
+        with patch('os.write', side_effect=OSError("Test error")):
+            client.send_to_server(request)  # Should handle exception gracefully
+        client.tx_queue.popleft()
+        client.wake_pending = False
+
+    def test_drain_tx_queue(self):
+        """Test handing queued requests to the connection."""
         mock_message = MagicMock()
-        mock_key = MagicMock()
-        mock_key.data = mock_message
-        
-        # Setup selector mock
-        self.mock_selector.get_map.return_value = {'mock_key': mock_key}
-        
-        # Send test request
+        client.set_connection(mock_message)
+
         request = {"action": "test_action"}
-        client.send_to_server(request)
-        
-        # Verify message handling
-        self.assertEqual(mock_message.request, request)
-        mock_message.queue_request.assert_called_once()
+        client.tx_queue.append(request)
+        client.wake_pending = True
+        with patch('os.read', side_effect=BlockingIOError()):
+            self.assertTrue(client.drain_tx_queue())
+        self.assertFalse(client.wake_pending)
+
+        mock_message.queue_request.assert_called_once_with(request)
         mock_message._set_selector_events_mask.assert_called_once_with("w")
-        
-        # Test exception handling
-        self.mock_selector.get_map.side_effect = Exception("Test error")
-        client.send_to_server(request)  # Should handle exception gracefully
-    
+        self.assertEqual(len(client.tx_queue), 0)
+
+        # The shutdown sentinel stops the network loop
+        client.tx_queue.append(client._SHUTDOWN)
+        with patch('os.read', side_effect=BlockingIOError()):
+            self.assertFalse(client.drain_tx_queue())
+        client.set_connection(None)
+
+        # With no connection, the next request (re)connects first
+        client.tx_queue.append(request)
+        with patch('os.read', side_effect=BlockingIOError()), \
+             patch('client.start_connection', side_effect=lambda gui, req: client.set_connection(mock_message)) as mock_start:
+            self.assertTrue(client.drain_tx_queue())
+        mock_start.assert_called_once_with(client.gui, None)
+        mock_message.queue_request.assert_called_with(request)
+        client.set_connection(None)
+
+    def test_drain_tx_queue_wake_race(self):
+        """Test a request sent while the wake pipe drains still wakes the loop."""
+        mock_message = MagicMock()
+        client.set_connection(mock_message)
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        self.addCleanup(os.close, wake_r)
+        self.addCleanup(os.close, wake_w)
+        saved = (client.wake_r, client.wake_w)
+        client.wake_r, client.wake_w = wake_r, wake_w
+        real_read = os.read
+        sent_during_drain = []
+
+        def read_while_sending(fd, n):
+            # The GUI thread sends just as the network thread reads the pipe
+            if not sent_during_drain:
+                sent_during_drain.append(True)
+                client.send_to_server({"action": "second"})
+            return real_read(fd, n)
+
+        try:
+            client.send_to_server({"action": "first"})
+            with patch('os.read', side_effect=read_while_sending):
+                self.assertTrue(client.drain_tx_queue())
+            self.assertEqual(mock_message.queue_request.call_count, 2)
+            self.assertFalse(client.wake_pending)
+
+            # The next request must still make the pipe readable
+            client.send_to_server({"action": "third"})
+            self.assertEqual(select.select([wake_r], [], [], 0)[0], [wake_r])
+            self.assertTrue(client.drain_tx_queue())
+            mock_message.queue_request.assert_called_with({"action": "third"})
+        finally:
+            client.wake_r, client.wake_w = saved
+            client.wake_pending = False
+            client.tx_queue.clear()
+            client.set_connection(None)
+
+    def test_drain_tx_queue_error(self):
+        """Test a failing request is reported without stopping the network loop."""
+        mock_message = MagicMock()
+        request = {"action": "test_action"}
+
+        # Connecting fails: the error reaches the GUI and the loop keeps running
+        client.tx_queue.append(request)
+        with patch('os.read', side_effect=BlockingIOError()), \
+             patch('client.start_connection', side_effect=RuntimeError("no msgpack")), \
+             patch.object(client.gui, 'queue_server_response') as mock_response:
+            self.assertTrue(client.drain_tx_queue())
+        mock_response.assert_called_once_with(
+            {"error": "Could not send request: no msgpack"}, "error"
+        )
+        self.assertEqual(len(client.tx_queue), 0)
+
+        # Queuing one request fails: the rest still go out
+        client.set_connection(mock_message)
+        mock_message.queue_request.side_effect = [ValueError("bad request"), None]
+        client.tx_queue.extend([request, request])
+        with patch('os.read', side_effect=BlockingIOError()), \
+             patch.object(client.gui, 'queue_server_response') as mock_response:
+            self.assertTrue(client.drain_tx_queue())
+        mock_response.assert_called_once()
+        self.assertEqual(mock_message.queue_request.call_count, 2)
+        mock_message._set_selector_events_mask.assert_called_once_with("w")
+        client.set_connection(None)
+
     def test_network_thread(self):
         """Test network thread event handling."""
-        request = {"action": "test"}
-        
-        # Mock message and selector events
         mock_message = MagicMock()
+        client.set_connection(mock_message)
         mock_key = MagicMock()
         mock_key.data = mock_message
-        
-        # Test normal event processing
+        wake_key = MagicMock()
+        wake_key.data = client._WAKE
+
+        # Test normal event processing, then a shutdown through the wake pipe
         self.mock_selector.select.side_effect = [
             [(mock_key, selectors.EVENT_READ)],  # First call returns event
-            []  # Second call returns no events
+            [(wake_key, selectors.EVENT_READ)],  # Then the shutdown wake-up
         ]
-        self.mock_selector.get_map.side_effect = [{1: mock_key}, {}]  # First has key, then empty to exit
-        client.network_thread(request)
+        client.tx_queue.append(client._SHUTDOWN)
+        with patch('os.read', side_effect=BlockingIOError()):
+            client.network_thread()
         mock_message.process_events.assert_called_with(selectors.EVENT_READ)
-        
+        self.mock_selector.get_map.assert_not_called()
+        # Shutting down closes the open connection
+        mock_message.close.assert_called_once()
+        self.assertIsNone(client.msg_obj)
+
         # Reset mocks
         self.mock_selector.select.reset_mock()
-        self.mock_selector.get_map.reset_mock()
         mock_message.process_events.reset_mock()
         mock_message.close.reset_mock()
-        
-        # Test exception in process_events
+        client.set_connection(mock_message)
+
+        # Test exception in process_events closes the connection but the
+        # thread keeps running until shutdown
         self.mock_selector.select.side_effect = [
             [(mock_key, selectors.EVENT_READ)],  # First call returns event
-            []  # Second call returns no events
+            [(wake_key, selectors.EVENT_READ)],  # Then the shutdown wake-up
         ]
-        self.mock_selector.get_map.side_effect = [{1: mock_key}, {}]
         mock_message.process_events.side_effect = Exception("Test error")
-        client.network_thread(request)
+        client.tx_queue.append(client._SHUTDOWN)
+        with patch('os.read', side_effect=BlockingIOError()):
+            client.network_thread()
         mock_message.close.assert_called_once()
-        
-        # Reset mocks
+        self.assertIsNone(client.msg_obj)
+        self.assertEqual(self.mock_selector.select.call_count, 2)
+
+        # A real connection closed by the server is dropped, not polled forever
+        sock = MagicMock()
+        sock.recv_into.return_value = 0
+        message = Message(self.mock_selector, sock, ('test_host', 12345), self.gui, None, "json")
+        client.set_connection(message)
+        closed_key = MagicMock()
+        closed_key.data = message
+        events = [
+            [(closed_key, selectors.EVENT_READ)],
+            [(wake_key, selectors.EVENT_READ)],
+        ]
+        connection_at_select = []
+
+        def select(timeout=None):
+            connection_at_select.append(client.msg_obj)
+            return events.pop(0)
+
         self.mock_selector.select.reset_mock()
-        self.mock_selector.get_map.reset_mock()
-        mock_message.process_events.reset_mock()
-        mock_message.close.reset_mock()
-        
+        self.mock_selector.select.side_effect = select
+        client.tx_queue.append(client._SHUTDOWN)
+        with patch('os.read', side_effect=BlockingIOError()):
+            client.network_thread()
+        # Closed right after the failed read, before the next select()
+        self.assertEqual(connection_at_select, [message, None])
+        sock.close.assert_called_once()
+        self.mock_selector.unregister.assert_called_with(sock)
+
         # Test keyboard interrupt
         self.mock_selector.select.side_effect = KeyboardInterrupt()
-        client.network_thread(request)
-        
+        client.network_thread()
+
         # Verify selector was closed in all cases
-        self.assertEqual(self.mock_selector.close.call_count, 3)
+        self.assertEqual(self.mock_selector.close.call_count, 4)
+
+    def test_start_network_thread(self):
+        """Test the network thread is started once as a daemon."""
+        with patch('threading.Thread') as mock_thread:
+            thread = client.start_network_thread()
+        mock_thread.assert_called_once_with(target=client.network_thread, daemon=True)
+        thread.start.assert_called_once()
+        self.assertIs(client.net_thread, thread)
+        client.net_thread = None
+
+    def test_on_close(self):
+        """Test closing the window stops the network thread first."""
+        mock_thread = MagicMock()
+        mock_thread.is_alive.side_effect = [True, False]
+        client.net_thread = mock_thread
+        with patch('client.send_to_server') as mock_send, \
+             patch('os.close') as mock_close, \
+             patch.object(client.root, 'destroy') as mock_destroy:
+            client.on_close()
+        mock_send.assert_called_once_with(client._SHUTDOWN)
+        mock_thread.join.assert_called_once_with(timeout=1)
+        self.assertEqual(mock_close.call_count, 2)
+        mock_destroy.assert_called_once()
+        client.net_thread = None
+
+        # The thread never started: close the selector and the wake pipe here
+        with patch('os.close') as mock_close, \
+             patch.object(client.root, 'destroy') as mock_destroy:
+            client.on_close()
+        self.mock_selector.close.assert_called_once()
+        self.assertEqual(mock_close.call_count, 2)
+        mock_destroy.assert_called_once()
 
     def test_start_connection(self):
         """Test connection initialization."""
@@ -167,10 +330,12 @@ class TestClient(unittest.TestCase):
         client.start_connection(self.gui, request)
         
         # Verify socket setup
+        self.mock_socket.setsockopt.assert_any_call(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.mock_socket.setblocking.assert_called_once_with(False)
         self.mock_socket.connect_ex.assert_called_once_with(('test_host', 12345))
         
-        # Verify selector registration
+        # Verify selector registration and the cached connection
+        self.assertIs(client.msg_obj, self.mock_message_class.return_value)
         self.mock_selector.register.assert_called_once()
         register_args = self.mock_selector.register.call_args
         self.assertEqual(register_args[0][0], self.mock_socket)
@@ -219,6 +384,19 @@ class TestClient(unittest.TestCase):
                         mock_exit.assert_called_once_with(1)
                         mock_init.assert_not_called()
     
+    def test_main_msgpack_missing(self):
+        """Test msgpack mode without the msgpack package stops at startup."""
+        test_args = ['client.py', 'localhost', '65432', 'msgpack']
+        with patch('sys.argv', test_args), \
+             patch('msg_client.msgpack', None), \
+             patch('builtins.print') as mock_print, \
+             patch('client.initialize_client') as mock_init:
+            with self.assertRaises(SystemExit) as cm:
+                client.main()
+        self.assertEqual(cm.exception.code, 1)
+        mock_print.assert_called_once_with("Error: msgpack protocol requires the msgpack package")
+        mock_init.assert_not_called()
+
     def test_main_success(self):
         """Test main function successful execution."""
         # Test normal execution
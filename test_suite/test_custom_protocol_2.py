@@ -55,6 +55,10 @@ class TestCustomProtocol(unittest.TestCase):
         nested = {"data": [1, {"x": 2}]}
         self.assertEqual(CustomProtocol.serialize_part(nested), '{data:[1,{x:2}]}')
 
+        # Subclasses serialize like their base types
+        from collections import OrderedDict
+        self.assertEqual(CustomProtocol.serialize_part(OrderedDict(data=[1, {"x": 2}])), '{data:[1,{x:2}]}')
+
     def test_serialize(self):
         """Test full dictionary serialization."""
         test_data = {
@@ -67,6 +71,30 @@ class TestCustomProtocol(unittest.TestCase):
         result = self.protocol.serialize(test_data)
         self.assertEqual(result, expected)
 
+    def test_serialize_with_action(self):
+        """Test serializing by action gives the same bytes as the full key walk."""
+        for action, fields in self.protocol.dict_reconstruction.items():
+            data = {field: f"v{index}" for index, field in enumerate(fields)}
+            data["unrelated"] = "ignored"
+            self.assertEqual(self.protocol.serialize(data, action), self.protocol.serialize(data), action)
+
+        # Missing fields are skipped, as before
+        self.assertEqual(self.protocol.serialize({"username": "u"}, "login"), b'["u"]')
+
+    def test_serialize_header(self):
+        """Test the header fast path matches the generic serializer."""
+        for action in ("send_message", "load_page_data_r", 'not "known"'):
+            header = {"action": action, "content-length": 120, "checksum": 7}
+            self.assertEqual(
+                self.protocol.serialize_header(action, 120, 7),
+                self.protocol.serialize(header, "header")
+            )
+        header = self.protocol.serialize_header("login", 5, 255)
+        self.assertEqual(
+            self.protocol.deserialize(header, "header"),
+            {"action": "login", "content-length": 5, "checksum": 255}
+        )
+
     def test_deserialize_part_primitives(self):
         """Test deserialization of primitive data types."""
         # Test string deserialization
@@ -76,6 +104,8 @@ class TestCustomProtocol(unittest.TestCase):
         # Test number deserialization
         self.assertEqual(CustomProtocol.deserialize_part("42"), 42)
         self.assertEqual(CustomProtocol.deserialize_part("3.14"), 3.14)
+        self.assertEqual(CustomProtocol.deserialize_part("-7"), -7)
+        self.assertEqual(CustomProtocol.deserialize_part("-2.5"), -2.5)
         
         # Test boolean deserialization
         self.assertEqual(CustomProtocol.deserialize_part("true"), True)
@@ -123,6 +153,22 @@ class TestCustomProtocol(unittest.TestCase):
         result = self.protocol.deserialize(b'["single_value"]', "login_register")
         self.assertEqual(result, {})
 
+    def test_backslash_round_trip(self):
+        """Test strings containing or ending in backslashes survive a round trip."""
+        message = {
+            "message": "see C:\\temp\\",
+            "recipient_username": "bob",
+            "timestamp": "2025-02-10 10:00:00",
+            "uuid": 1
+        }
+        data = self.protocol.serialize(message, "send_message")
+        self.assertEqual(self.protocol.deserialize(data, "send_message"), message)
+
+        for value in ["\\", 'a\\"b', '\\"', "x\\\\", ["\\", "y"], {"k": "v\\"}]:
+            self.assertEqual(
+                CustomProtocol.deserialize_part(CustomProtocol.serialize_part(value)), value
+            )
+
     def test_parse_dict(self):
         """Test parsing of dictionary from serialized string."""
         # Test empty dictionary
@@ -207,13 +253,20 @@ class TestCustomProtocol(unittest.TestCase):
             ['"a,b"', '{x:1}', 'c']
         )
 
-    def test_is_number(self):
-        """Test number validation."""
-        self.assertTrue(CustomProtocol._is_number("42"))
-        self.assertTrue(CustomProtocol._is_number("-42"))
-        self.assertTrue(CustomProtocol._is_number("3.14"))
-        self.assertFalse(CustomProtocol._is_number("abc"))
-        self.assertFalse(CustomProtocol._is_number("12.34.56"))
+        # Test escaped quotes don't end a string early
+        self.assertEqual(
+            CustomProtocol._split_items('"say \\"hi, there\\"",[1,2]'),
+            ['"say \\"hi, there\\""', '[1,2]']
+        )
+
+    def test_deserialize_numbers(self):
+        """Test numbers are parsed by int()/float() and anything else is left as text."""
+        self.assertEqual(CustomProtocol.deserialize_part("42"), 42)
+        self.assertEqual(CustomProtocol.deserialize_part("-42"), -42)
+        self.assertEqual(CustomProtocol.deserialize_part("3.14"), 3.14)
+        self.assertEqual(CustomProtocol.deserialize_part("1e3"), 1000.0)
+        self.assertEqual(CustomProtocol.deserialize_part("abc"), "abc")
+        self.assertEqual(CustomProtocol.deserialize_part("12.34.56"), "12.34.56")
 
     def test_escape_unescape_key(self):
         """Test key escaping and unescaping."""
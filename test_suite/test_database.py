@@ -2,12 +2,13 @@ import unittest
 import sys
 import os
 import sqlite3
+from unittest.mock import patch
 
 # to run: python3 -m unittest test_suite/test_database.py -v
 
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from database import MessageDatabase
+from database import MessageDatabase, COUNT_CACHE_SIZE, MIN_SQLITE_VERSION
 
 class TestDatabase(unittest.TestCase):
     def setUp(self):
@@ -74,6 +75,31 @@ class TestDatabase(unittest.TestCase):
         conn = invalid_db.connect()
         self.assertIsNone(conn)
 
+    def test_connection_reused(self):
+        """Test queries share one WAL-mode connection."""
+        conn = self.db.connect()
+        self.register_user(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
+        self.db.search_accounts("", 0)
+        self.assertIs(self.db.connect(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+        self.assertEqual(conn.execute("PRAGMA temp_store").fetchone()[0], 2)  # MEMORY
+        self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -8000)
+        # Row access for one query doesn't leak into the shared connection
+        self.db.login(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
+        self.assertIsNone(conn.row_factory)
+
+    def test_connect_old_sqlite(self):
+        """Test an SQLite without RETURNING support is refused up front."""
+        self.db.close()
+        too_old = (MIN_SQLITE_VERSION[0], MIN_SQLITE_VERSION[1] - 1, 0)
+        with patch("database.sqlite3.sqlite_version_info", too_old):
+            with self.assertRaises(RuntimeError):
+                self.db.connect()
+            with self.assertRaises(RuntimeError):
+                MessageDatabase(self.db_file)
+        self.assertIsNone(self.db.conn)
+
     def test_create_tables(self):
         """Test database table creation."""
         # Drop existing tables if they exist
@@ -114,6 +140,18 @@ class TestDatabase(unittest.TestCase):
         self.assertIn("status", column_names)
         self.assertIn("timestamp", column_names)
 
+        # Verify the message lookup indexes exist
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        index_names = [index[0] for index in cursor.fetchall()]
+        self.assertIn("idx_messages_recipient", index_names)
+        self.assertIn("idx_messages_sender", index_names)
+        self.assertIn("idx_messages_pair", index_names)
+        self.assertIn("idx_users_username_nocase", index_names)
+
+        # A prefix search is answered from the index range
+        cursor.execute("EXPLAIN QUERY PLAN SELECT userid FROM users WHERE username LIKE ?", ("test%",))
+        self.assertIn("idx_users_username_nocase", str(cursor.fetchall()))
+
     def test_check_username(self):
         # Create test user
         self.register_user(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
@@ -139,6 +177,21 @@ class TestDatabase(unittest.TestCase):
         self.assertNotEqual(error, "")
         self.assertEqual(uuid, "")
 
+    def test_user_lookups_cached(self):
+        """Test username/userid lookups are served from the cache until the account is deleted."""
+        self.register_user(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
+        success, error, uuid = self.db.get_user_uuid(self.test_user1["username"])
+        self.assertEqual(self.db.get_user_username(int(uuid)), self.test_user1["username"])
+
+        # No query is needed once a user has been seen
+        with patch.object(self.db, "connect", return_value=None):
+            self.assertEqual(self.db.get_user_uuid(self.test_user1["username"]), (True, "", uuid))
+            self.assertEqual(self.db.get_user_username(uuid), self.test_user1["username"])
+
+        self.db.delete_user(uuid)
+        self.assertFalse(self.db.get_user_uuid(self.test_user1["username"])[0])
+        self.assertIsNone(self.db.get_user_username(uuid))
+
     def test_get_associated_socket(self):
         # Create test user
         self.register_user(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
@@ -153,6 +206,15 @@ class TestDatabase(unittest.TestCase):
         socket = self.db.get_associated_socket(999)  # Non-existent UUID
         self.assertIsNone(socket)
 
+        # Logging in again moves the user to the new socket
+        self.db.login(self.test_user1["username"], self.test_user1["password"], "127.0.0.1:9000")
+        self.assertEqual(self.db.get_associated_socket(uuid), "127.0.0.1:9000")
+        self.assertEqual(self.db.get_associated_socket(int(uuid)), "127.0.0.1:9000")
+
+        # A deleted user has no socket
+        self.db.delete_user(uuid)
+        self.assertIsNone(self.db.get_associated_socket(uuid))
+
     def test_store_message(self):
         """Test message storage functionality."""
         # Create test users first
@@ -171,11 +233,22 @@ class TestDatabase(unittest.TestCase):
         success, error = self.db.store_message("999", uuid2, "Test message", True, "2025-02-10 10:00:00")
         self.assertFalse(success)
         self.assertNotEqual(error, "")
+        self.assertIn("sender", error)
         
         # Test storing message with invalid recipient
         success, error = self.db.store_message(uuid1, "999", "Test message", True, "2025-02-10 10:00:00")
         self.assertFalse(success)
         self.assertNotEqual(error, "")
+        self.assertIn("recipient", error)
+        self.assertFalse(self.db.conn.in_transaction)
+
+        # A rejected message doesn't keep the write lock from other connections
+        other = sqlite3.connect(self.db_file, timeout=0.1)
+        try:
+            other.execute("UPDATE users SET associated_socket = 'elsewhere' WHERE userid = ?", (uuid1,))
+            other.commit()
+        finally:
+            other.close()
         
         # Verify message was stored correctly
         conn = self.db.connect()
@@ -207,6 +280,21 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(total, 0)
         self.assertEqual(len(accounts), 0)
 
+        # Cached counts follow new and deleted accounts
+        self.db.register("testuser3", "password789", "127.0.0.1:8002")
+        accounts, total = self.db.search_accounts("", 0)
+        self.assertEqual(total, 3)
+        self.db.delete_user(self.db.get_user_uuid("testuser3")[2])
+        accounts, total = self.db.search_accounts("", 0)
+        self.assertEqual(total, 2)
+
+        # The cache keeps only the most recently used patterns
+        for i in range(COUNT_CACHE_SIZE + 10):
+            self.db.search_accounts(f"term{i}*", 0)
+        self.assertEqual(len(self.db._count_cache), COUNT_CACHE_SIZE)
+        self.assertNotIn("%", self.db._count_cache)
+        self.assertIn(f"term{COUNT_CACHE_SIZE + 9}%", self.db._count_cache)
+
     def test_get_user_password(self):
         # Create test user first
         self.register_user(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
@@ -323,6 +411,9 @@ class TestDatabase(unittest.TestCase):
         count = cursor.fetchone()[0]
         self.assertEqual(count, 0)
 
+        # Nothing to delete
+        self.assertEqual(self.db.delete_messages([]), [])
+
     def test_load_undelivered(self):
         # Create test users first
         self.register_user(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
@@ -344,6 +435,7 @@ class TestDatabase(unittest.TestCase):
         uuid, error = self.db.register("newuser", "password", "socket")
         self.assertIsNotNone(uuid)
         self.assertEqual(error, "")
+        self.assertEqual(uuid, self.db.get_user_uuid("newuser")[2])
 
         # Test registration with None values
         uuid, error = self.db.register(None, None, None)
@@ -355,6 +447,21 @@ class TestDatabase(unittest.TestCase):
         self.assertIsNone(uuid)
         self.assertNotEqual(error, "")
 
+    def test_failed_write_releases_lock(self):
+        """Test a failed write doesn't leave the shared connection holding the write lock."""
+        self.db.register("newuser", "password", "socket")
+        uuid, error = self.db.register("newuser", "password", "socket")
+        self.assertIsNone(uuid)
+        self.assertFalse(self.db.conn.in_transaction)
+
+        # Another connection can still write
+        other = sqlite3.connect(self.db_file, timeout=0.1)
+        try:
+            other.execute("INSERT INTO users (username, hashed_password) VALUES ('other', 'pw')")
+            other.commit()
+        finally:
+            other.close()
+
     def test_login(self):
         # Create test user
         self.register_user(self.test_user1["username"], self.test_user1["password"], self.test_user1["socket"])
@@ -363,6 +470,7 @@ class TestDatabase(unittest.TestCase):
         result = self.db.login(self.test_user1["username"], self.test_user1["password"], "new_socket")
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["username"], self.test_user1["username"])
+        self.assertEqual(self.db.get_associated_socket(result[0]["userid"]), "new_socket")
 
         # Test login with wrong password
         result = self.db.login(self.test_user1["username"], "wrong_password", "socket")
@@ -411,6 +519,8 @@ class TestDatabase(unittest.TestCase):
         # Test deleting messages for existing user
         result = self.db.delete_user_messages(int(uuid1))
         self.assertTrue(len(result) > 0)
+        # each user sent one and received one of the two messages
+        self.assertEqual(sorted(result), [(int(uuid1), 2), (int(uuid2), 2)])
 
         # Verify messages are deleted
         messages = self.db.load_private_chat(int(uuid1), self.test_user2["username"])
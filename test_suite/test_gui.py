@@ -10,9 +10,8 @@ class TestClientGUI(unittest.TestCase):
     def setUp(self):
         self.root = tk.Tk()
         self.send_to_server = MagicMock()
-        self.network_thread = MagicMock()
         with patch('tkinter.messagebox.showerror'):
-            self.gui = ClientGUI(self.root, self.send_to_server, self.network_thread)
+            self.gui = ClientGUI(self.root, self.send_to_server)
         
     def tearDown(self):
         try:
@@ -52,6 +51,40 @@ class TestClientGUI(unittest.TestCase):
         error_widgets = self.gui.error_frame.winfo_children()
         self.assertTrue(any(widget.cget("text") == error_msg for widget in error_widgets))
 
+    def test_create_error_page_reused(self):
+        """Test the error page is built once and its message updated"""
+        self.gui.create_error_page("First error")
+        label = self.gui.error_message_label
+        self.gui.create_error_page("Second error")
+        self.assertIs(self.gui.error_message_label, label)
+        self.assertEqual(label.cget("text"), "Second error")
+
+    def test_create_chat_page_reused(self):
+        """Test the chat page widgets survive navigating away and back"""
+        self.gui.create_chat_page()
+        listbox = self.gui.accounts_listbox
+        self.gui.create_login_page()
+        self.gui.create_chat_page()
+        self.assertIs(self.gui.accounts_listbox, listbox)
+
+    def test_create_chat_page_reused_resets_state(self):
+        """Test a reused chat page doesn't keep the previous session's view"""
+        self.gui.create_chat_page()
+        self.gui.search_bar.insert(0, "alice")
+        self.gui.entry.insert(0, "half-typed")
+        self.gui.current_page = 3
+        self.gui.max_accounts_page = 5
+        self.gui.num_messages = 30
+        self.gui.selected_account = "alice"
+        self.gui.create_login_page()
+        self.gui.create_chat_page()
+        self.assertEqual(self.gui.search_bar.get(), "")
+        self.assertEqual(self.gui.entry.get(), "")
+        self.assertEqual(self.gui.current_page, 0)
+        self.assertEqual(self.gui.max_accounts_page, 0)
+        self.assertEqual(self.gui.num_messages, 10)
+        self.assertIsNone(self.gui.selected_account)
+
     def test_create_login_page(self):
         """Test login page creation"""
         self.gui.create_login_page()
@@ -97,6 +130,20 @@ class TestClientGUI(unittest.TestCase):
             self.assertEqual(self.gui.current_page, 1)
             mock_search.assert_called_once()
 
+    def test_update_pagination(self):
+        """Test the last page is found without an extra round trip"""
+        self.gui.create_chat_page()
+        self.gui.current_page = 0
+        self.gui.update_pagination(10, 10)
+        self.assertEqual(self.gui.max_accounts_page, 0)
+        self.gui.update_pagination(11, 10)
+        self.assertEqual(self.gui.max_accounts_page, 1)
+        self.gui.update_pagination(0, 0)
+        self.assertEqual(self.gui.max_accounts_page, 0)
+        # A short page ends the list even when total_count says otherwise
+        self.gui.update_pagination(25, 4)
+        self.assertEqual(self.gui.max_accounts_page, 0)
+
     def test_on_account_select(self):
         """Test account selection"""
         self.gui.create_chat_page()  # Initialize required widgets
@@ -105,8 +152,10 @@ class TestClientGUI(unittest.TestCase):
         mock_event.widget = self.gui.accounts_listbox
         mock_event.widget.curselection = MagicMock(return_value=[0])
         mock_event.widget.get = MagicMock(return_value="test_user")
+        self.gui._accounts_shown = ["test_user"]
         self.gui.on_account_select(mock_event)
         self.assertEqual(self.gui.selected_account, "test_user")
+        mock_event.widget.get.assert_not_called()
 
     def test_load_more_messages(self):
         """Test loading more messages"""
@@ -139,6 +188,20 @@ class TestClientGUI(unittest.TestCase):
         self.assertEqual(self.gui.accounts_listbox.get(1), "user2")
         self.assertEqual(self.gui.accounts_listbox.get(2), "user3")
 
+    def test_update_accounts_list_diff(self):
+        """Test a refresh only touches the rows that changed"""
+        self.gui.create_chat_page()
+        self.gui.update_accounts_list([(1, "user1"), (2, "user2"), (3, "user3")])
+        with patch.object(self.gui.accounts_listbox, 'insert', wraps=self.gui.accounts_listbox.insert) as mock_insert:
+            self.gui.update_accounts_list([(1, "user1"), (4, "user4")])
+            mock_insert.assert_called_once_with(1, "user4")
+        self.assertEqual(self.gui.accounts_listbox.get(0, tk.END), ("user1", "user4"))
+
+        # An identical refresh makes no Tk calls at all
+        with patch.object(self.gui.accounts_listbox, 'delete') as mock_delete:
+            self.gui.update_accounts_list([(1, "user1"), (4, "user4")])
+            mock_delete.assert_not_called()
+
     def test_update_messages_list(self):
         """Test updating messages list"""
         self.gui.create_chat_page()
@@ -153,12 +216,31 @@ class TestClientGUI(unittest.TestCase):
         self.assertEqual(self.gui.messages_listbox.get(0), "From sender1: Hello")
         self.assertEqual(self.gui.messages_listbox.get(1), "To recipient1: Hi")
 
-    @patch('threading.Thread')
-    def test_thread_send(self, mock_thread):
-        """Test thread sending function"""
-        request = {"action": "test"}
-        self.gui.thread_send(request)
-        mock_thread.assert_called_once()
+    def test_update_messages_list_new_message(self):
+        """Test a new message at the top of the list costs two Tk calls"""
+        self.gui.create_chat_page()
+        self.gui.username = "testuser"
+        page = [(i, "sender1", "testuser", f"msg{i}", "2024-01-01") for i in range(10, 0, -1)]
+        self.gui.update_messages_list(page, 0)
+        newer = [(11, "sender1", "testuser", "msg11", "2024-01-01")] + page[:-1]
+        listbox = self.gui.messages_listbox
+        with patch.object(listbox, 'insert', wraps=listbox.insert) as mock_insert, \
+             patch.object(listbox, 'delete', wraps=listbox.delete) as mock_delete:
+            self.gui.update_messages_list(newer, 0)
+        self.assertEqual(mock_insert.call_count + mock_delete.call_count, 2)
+        self.assertEqual(listbox.get(0), "From sender1: msg11")
+        self.assertEqual(listbox.size(), 10)
+
+    def test_requests_sent_without_threads(self):
+        """Test requests are handed straight to send_to_server"""
+        self.gui.user_uuid = "test-uuid"
+        with patch('threading.Thread') as mock_thread:
+            self.gui.load_page_data()
+        mock_thread.assert_not_called()
+        self.send_to_server.assert_called_once_with({
+            "action": "load_page_data",
+            "content": {"uuid": "test-uuid"},
+        })
 
 # test_load_page_data
 
@@ -208,11 +290,7 @@ class TestClientGUI(unittest.TestCase):
             }
         }
         
-        # Verify that either network_thread or send_to_server was called
-        if self.network_thread.call_count > 0:
-            self.network_thread.assert_called_with(expected_request)
-        else:
-            self.send_to_server.assert_called_with(expected_request)
+        self.send_to_server.assert_called_once_with(expected_request)
 
     def test_delete_account(self):
         """Test account deletion"""
@@ -392,5 +470,32 @@ class TestClientGUI(unittest.TestCase):
         }
         self.send_to_server.assert_called_with(expected_request)
 
+    def test_queue_server_response_batches(self):
+        """Test a burst of responses is handled in one Tk callback"""
+        with patch.object(self.root, 'after') as mock_after:
+            self.gui.queue_server_response({"uuid": 1}, "login_r")
+            self.gui.queue_server_response({"messages": []}, "load_private_chat_r")
+        mock_after.assert_called_once_with(0, self.gui.drain_server_responses)
+
+        with patch.object(self.gui, 'handle_server_response') as mock_handle:
+            self.gui.drain_server_responses()
+        self.assertEqual(mock_handle.call_count, 2)
+        mock_handle.assert_called_with({"messages": []}, "load_private_chat_r")
+        self.assertFalse(self.gui._responses_scheduled)
+
+    def test_load_private_chat_r_bounded(self):
+        """Test the chat view keeps only the newest max_chat_messages messages"""
+        self.gui.create_chat_page()
+        self.root.update()
+        self.gui.max_chat_messages = 2
+        messages = [
+            {"status": "delivered", "recipient_username": "other", "sender_username": "me",
+             "timestamp": f"t{i}", "message": f"m{i}"}
+            for i in range(3)
+        ]
+        with patch.object(self.gui.message_display, 'insert') as mock_insert:
+            self.gui.handle_server_response({"messages": messages}, "load_private_chat_r")
+        mock_insert.assert_called_once_with(tk.END, "[t1] me: m1\n[t2] me: m2\n")
+
 if __name__ == '__main__':
     unittest.main()
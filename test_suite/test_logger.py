@@ -0,0 +1,39 @@
+import unittest
+import logging
+import os
+from unittest.mock import patch
+from logger import set_logger
+
+# to run: python3 -m unittest test_suite/test_logger.py -v
+
+class TestLogger(unittest.TestCase):
+    def tearDown(self):
+        """Drop the handlers the tests attached."""
+        logger = logging.getLogger("test_logger")
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        if os.path.exists("logs/test_logger.log"):
+            os.remove("logs/test_logger.log")
+
+    def test_level_from_environment(self):
+        """Test LOG_LEVEL sets the level, case-insensitively."""
+        with patch.dict(os.environ, {"LOG_LEVEL": "debug"}):
+            logger = set_logger("test_logger", "test_logger.log")
+        self.assertEqual(logger.level, logging.DEBUG)
+
+    def test_default_level(self):
+        """Test the level is INFO when LOG_LEVEL is unset."""
+        with patch.dict(os.environ, clear=True):
+            logger = set_logger("test_logger", "test_logger.log")
+        self.assertEqual(logger.level, logging.INFO)
+
+    def test_unknown_level(self):
+        """Test an unknown LOG_LEVEL falls back to INFO instead of raising."""
+        with patch.dict(os.environ, {"LOG_LEVEL": "verbose"}):
+            logger = set_logger("test_logger", "test_logger.log")
+        self.assertEqual(logger.level, logging.INFO)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@ import socket
 import json
 import struct
 from unittest.mock import Mock, patch
-from msg_client import Message
+from msg_client import Message, msgpack
 from custom_protocol_2 import CustomProtocol
 
 # to run: python3 -m unittest test_suite/test_msg_client.py -v
@@ -59,24 +59,35 @@ class TestMessage(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.message._set_selector_events_mask("invalid")
 
+    def feed_socket(self, data):
+        """Make the mocked socket's recv_into deliver data."""
+        def recv_into(buf):
+            buf[:len(data)] = data
+            return len(data)
+        self.sock.recv_into.side_effect = recv_into
+
     def test_private_read(self):
         """Test the _read method for successful and blocking cases."""
         # Test successful read
-        self.sock.recv.return_value = b"test data"
+        self.feed_socket(b"test data")
         self.message._read()
         self.assertEqual(self.message._recv_buffer, b"test data")
-        self.sock.recv.assert_called_once_with(4096)
+        self.sock.recv_into.assert_called_once_with(self.message._rx_buf)
+
+        # Reads append to the existing buffer
+        self.message._read()
+        self.assertEqual(self.message._recv_buffer, b"test datatest data")
 
         # Test BlockingIOError
-        self.sock.recv.reset_mock()
-        self.sock.recv.side_effect = BlockingIOError()
+        self.sock.recv_into.reset_mock()
+        self.sock.recv_into.side_effect = BlockingIOError()
         self.message._read()  # Should not raise exception
-        self.sock.recv.assert_called_once_with(4096)
+        self.sock.recv_into.assert_called_once_with(self.message._rx_buf)
 
         # Test peer closed connection
-        self.sock.recv.reset_mock()
-        self.sock.recv.side_effect = None  # Reset side_effect
-        self.sock.recv.return_value = b""
+        self.sock.recv_into.reset_mock()
+        self.sock.recv_into.side_effect = None  # Reset side_effect
+        self.sock.recv_into.return_value = 0
         with self.assertRaises(RuntimeError):
             self.message._read()
 
@@ -110,6 +121,21 @@ class TestMessage(unittest.TestCase):
         decoded = self.message._json_decode(encoded, "utf-8")
         self.assertEqual(test_data, decoded)
 
+    def test_json_encode_without_orjson(self):
+        """Test the stdlib fallback produces the same JSON."""
+        test_data = {"key": "välue", "number": 42}
+        with patch('msg_client.orjson', None):
+            encoded = self.message._json_encode(test_data, "utf-8")
+        self.assertEqual(json.loads(encoded.decode("utf-8")), test_data)
+
+    def test_json_decode_without_orjson(self):
+        """Test the stdlib fallback decodes buffered (bytearray) data."""
+        encoded = bytearray(json.dumps({"key": "välue"}, ensure_ascii=False).encode("utf-8"))
+        with patch('msg_client.orjson', None):
+            decoded = self.message._json_decode(encoded, "utf-8")
+        self.assertEqual(decoded, {"key": "välue"})
+        self.assertEqual(self.message._json_decode(encoded, "utf-8"), decoded)
+
     def test_create_message_json_mode(self):
         """Test message creation in JSON mode."""
         self.message.protocol_mode = "json"
@@ -183,6 +209,18 @@ class TestMessage(unittest.TestCase):
             mock_write.assert_called_once()
             mock_log.assert_called_once_with("Error during read: Read error")
 
+    def test_process_events_peer_closed(self):
+        """Test a closed connection is raised to the caller, not swallowed."""
+        self.sock.recv_into.return_value = 0
+        with self.assertRaises(RuntimeError):
+            self.message.process_events(selectors.EVENT_READ)
+
+        self.message._send_buffer = bytearray(b"data")
+        self.message._request_queued = True
+        self.sock.send.side_effect = BrokenPipeError()
+        with self.assertRaises(BrokenPipeError):
+            self.message.process_events(selectors.EVENT_WRITE)
+
     @patch('selectors.DefaultSelector.modify')
     def test_process_events(self, mock_modify):
         """Test processing of read and write events."""
@@ -225,6 +263,46 @@ class TestMessage(unittest.TestCase):
             self.message.read()
             mock_process_response.assert_called_once()
 
+    def test_read_multiple_responses(self):
+        """Test that every complete response in one recv is handled."""
+        self.message.protocol_mode = "json"
+        frames = b""
+        for action in ("load_messages_r", "search_accounts_r"):
+            content = json.dumps({"action": action}).encode("utf-8")
+            header = json.dumps({"content-length": len(content), "action": action}).encode("utf-8")
+            frames += struct.pack(">BBH", 1, 0, len(header)) + header + content
+        # Leave a partial third frame behind in the buffer
+        self.feed_socket(frames + struct.pack(">BB", 1, 0))
+
+        self.message.read()
+
+        self.assertEqual(self.gui.queue_server_response.call_count, 2)
+        self.gui.queue_server_response.assert_called_with({"action": "search_accounts_r"}, "search_accounts_r")
+        self.assertEqual(self.message._recv_buffer, struct.pack(">BB", 1, 0))
+        self.assertIsNone(self.message._header_len)
+
+    def test_write_keeps_partial_read(self):
+        """Test finishing a send doesn't drop a response that is partly read."""
+        self.message.protocol_mode = "json"
+        content = json.dumps({"action": "load_messages_r"}).encode("utf-8")
+        header = json.dumps({"content-length": len(content), "action": "load_messages_r"}).encode("utf-8")
+        frame = struct.pack(">BBH", 1, 0, len(header)) + header + content
+
+        # The header arrives, then a queued request finishes sending
+        self.feed_socket(frame[:-5])
+        self.message.read()
+        self.assertIsNotNone(self.message.header)
+        self.message.queue_request()
+        self.sock.send.side_effect = lambda data: len(data)
+        self.message._write()
+        self.assertEqual(self.message._send_buffer, b"")
+
+        # The rest of the response still completes it
+        self.feed_socket(frame[-5:])
+        self.message.read()
+        self.gui.queue_server_response.assert_called_once_with({"action": "load_messages_r"}, "load_messages_r")
+        self.assertIsNone(self.message.header)
+
     def test_write(self):
         """Test the write method's full workflow."""
         # Test initial write when request is not queued
@@ -260,6 +338,18 @@ class TestMessage(unittest.TestCase):
         self.assertTrue(self.message._request_queued)
         self.assertTrue(len(self.message._send_buffer) > 0)
 
+    def test_queue_request_batches_frames(self):
+        """Test queued requests share the send buffer and keep read state."""
+        self.message._recv_buffer = bytearray(b"partial response")
+        self.message.queue_request()
+        first = bytes(self.message._send_buffer)
+        second_request = {"action": "load_messages", "content": {"num_messages": 10, "uuid": 1}}
+        self.message.queue_request(second_request)
+        self.assertEqual(self.message.request, second_request)
+        self.assertTrue(self.message._send_buffer.startswith(first))
+        self.assertGreater(len(self.message._send_buffer), len(first))
+        self.assertEqual(self.message._recv_buffer, b"partial response")
+
     def test_process_protoheader(self):
         """Test processing protocol header."""
         # Create a mock protocol header with version=1, protocol=1 (custom), header_len=10
@@ -331,7 +421,32 @@ class TestMessage(unittest.TestCase):
         self.message.process_response()
         
         # Verify GUI was called with decoded response
-        self.gui.handle_server_response.assert_called_once_with(test_response, "response")
+        self.gui.queue_server_response.assert_called_once_with(test_response, "response")
+
+    @unittest.skipIf(msgpack is None, "msgpack not installed")
+    def test_process_response_msgpack_mode(self):
+        """Test reading a full msgpack framed response."""
+        self.message.protocol_mode = "msgpack"
+        test_response = {"uuid": 7}
+        content = msgpack.packb(test_response)
+        header = msgpack.packb({"content-length": len(content), "action": "login_r"})
+        self.message._recv_buffer = bytearray(struct.pack(">BBH", 1, 3, len(header)) + header + content)
+
+        self.message.process_protoheader()
+        self.message.process_header()
+        self.message.process_response()
+
+        self.gui.queue_server_response.assert_called_once_with(test_response, "login_r")
+
+    @unittest.skipIf(msgpack is None, "msgpack not installed")
+    def test_queue_request_msgpack_mode(self):
+        """Test requests are framed with protocol byte 3 in msgpack mode."""
+        self.message.protocol_mode = "msgpack"
+        self.message.queue_request()
+        version, ptype, header_len = struct.unpack(">BBH", self.message._send_buffer[:4])
+        self.assertEqual(ptype, 3)
+        content = self.message._send_buffer[4 + header_len:]
+        self.assertEqual(msgpack.unpackb(content), self.request["content"])
 
     def test_process_response_custom_mode(self):
         """Test processing response in custom protocol mode."""
@@ -349,7 +464,7 @@ class TestMessage(unittest.TestCase):
         self.message.process_response()
         
         # Verify GUI was called with decoded response
-        self.gui.handle_server_response.assert_called_once()
+        self.gui.queue_server_response.assert_called_once()
 
 if __name__ == '__main__':
     unittest.main()
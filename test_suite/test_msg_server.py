@@ -4,7 +4,7 @@ import socket
 import json
 import struct
 from unittest.mock import Mock, patch, MagicMock
-from msg_server import Message, CustomProtocol
+from msg_server import Message, CustomProtocol, msgpack
 
 # to run: python3 -m unittest test_suite/test_msg_server.py -v
 
@@ -142,6 +142,39 @@ class TestMessage(unittest.TestCase):
         self.assertEqual(ptype, 2)  # Custom mode
         self.assertTrue(len(message) > header_len + 4)
 
+    @unittest.skipIf(msgpack is None, "msgpack not installed")
+    def test_create_message_msgpack_mode(self):
+        """Test message creation in msgpack protocol mode."""
+        self.message.protocol_mode = "msgpack"
+        content = self.message._encode_content({"test": "data"})
+        message = self.message._create_message(
+            content_bytes=content,
+            action="test_action",
+            content_length=len(content)
+        )
+        version, ptype, header_len = struct.unpack(">BBH", message[:4])
+        self.assertEqual(version, 1)
+        self.assertEqual(ptype, 3)  # msgpack mode
+        header = msgpack.unpackb(message[4:4 + header_len])
+        self.assertEqual(header["action"], "test_action")
+        self.assertEqual(msgpack.unpackb(message[4 + header_len:]), {"test": "data"})
+
+    @unittest.skipIf(msgpack is None, "msgpack not installed")
+    def test_read_msgpack_request(self):
+        """Test a msgpack framed request is decoded and answered in msgpack."""
+        self.message.protocol_mode = "msgpack"
+        content = msgpack.packb({"username": "test"})
+        header = msgpack.packb({"content-length": len(content), "action": "check_username"})
+        self.message._recv_buffer = struct.pack(">BBH", 1, 3, len(header)) + header + content
+        self.message._process_recv_buffer()
+        self.assertEqual(self.message.header["action"], "check_username")
+        self.assertEqual(self.message.request, content)
+
+        self.mock_db.check_username.return_value = (False, True)
+        response = self.message._create_response_content()
+        self.assertEqual(response["action"], "check_username_r")
+        self.assertEqual(msgpack.unpackb(response["content_bytes"]), {"message": False})
+
     def test_check_fields(self):
         """Test checking required fields in request."""
         # Test valid fields
@@ -248,6 +248,24 @@ class TestServer(unittest.TestCase):
                 self.assertEqual(cm.exception.code, 1)
                 mock_print.assert_called_once_with("Error: Port must be a number")
 
+    def test_main_msgpack_missing(self):
+        """Test msgpack mode without the msgpack package stops at startup"""
+        with patch('json.load') as mock_load, \
+             patch('msg_server.msgpack', None), \
+             patch('server.initialize_server') as mock_init:
+            mock_load.return_value = {
+                'host': 'localhost',
+                'port': 65432,
+                'protocol': 'msgpack',
+                'accepted_versions': [1]
+            }
+            with patch('builtins.print') as mock_print:
+                with self.assertRaises(SystemExit) as cm:
+                    server.main()
+                self.assertEqual(cm.exception.code, 1)
+                mock_print.assert_called_once_with("Error: msgpack protocol requires the msgpack package")
+            mock_init.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()